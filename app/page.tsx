@@ -137,8 +137,31 @@ export default function MLPipelinePage() {
         throw new Error(errorData.error || "Retraining failed")
       }
 
-      const data = await response.json()
-      setRetrainResult(data)
+      // Retraining runs as a background job; poll its status until it finishes
+      let job = await response.json()
+      setRetrainResult(job)
+      while (!job.finished) {
+        await new Promise((resolve) => setTimeout(resolve, 2000))
+        const statusResponse = await fetch(`${API_BASE_URL}/retrain/${job.job_id}`)
+        if (!statusResponse.ok) {
+          throw new Error("Could not fetch retraining status")
+        }
+        job = await statusResponse.json()
+        setRetrainResult({
+          ...job,
+          message:
+            job.message ||
+            (job.phase === "training" && job.epoch
+              ? `Training epoch ${job.epoch}/${job.epochs}` + (job.eta_seconds != null ? ` (about ${Math.round(job.eta_seconds)}s left)` : "")
+              : `Retraining: ${job.phase}`),
+        })
+      }
+      if (job.phase === "failed") {
+        throw new Error(job.error || "Retraining failed")
+      }
+      if (job.phase === "rejected") {
+        throw new Error(job.message || "The retrained model was not promoted")
+      }
       // Re-fetch insights after successful retraining
       const insightsResponse = await fetch(`${API_BASE_URL}/data-insights`)
       if (insightsResponse.ok) {
@@ -326,7 +349,7 @@ export default function MLPipelinePage() {
                               {paths.map((path, index) => (
                                 <Image
                                   key={index}
-                                  src={`${API_BASE_URL}/data-images/${path}`}
+                                  src={`${API_BASE_URL}/data-images/${path}?size=256`}
                                   alt={`${className} sample ${index + 1}`}
                                   width={100}
                                   height={100}
@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import time
+
+from src.data_pipeline import create_tf_dataset, list_image_files
+from src.preprocessing import create_data_generator
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TRAIN_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'train')
+
+
+def _measure(batches, num_batches, batch_size, warmup_batches=2):
+    """Pulls `num_batches` batches (after `warmup_batches`) and returns images/sec."""
+    iterator = iter(batches)
+    for _ in range(warmup_batches):
+        next(iterator)
+    images = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        x, _ = next(iterator)
+        images += len(x)
+    elapsed = time.perf_counter() - start
+    return {"images": images, "seconds": elapsed, "images_per_sec": images / elapsed if elapsed else 0.0}
+
+def benchmark_input_pipelines(data_dir=TRAIN_DATA_DIR, num_batches=50, batch_size=32, is_training=True):
+    """
+    Reports training input throughput (images/sec) of the ImageDataGenerator pipeline and of
+    the tf.data pipeline, uncached and with an in-memory cache of decoded images (second epoch).
+    """
+    results = {"data_dir": data_dir, "batch_size": batch_size, "num_batches": num_batches, "is_training": is_training}
+
+    generator, _ = create_data_generator(data_dir, batch_size=batch_size, is_training=is_training)
+    results["image_data_generator"] = _measure(generator, num_batches, batch_size)
+
+    files = list_image_files(data_dir)
+    dataset, _ = create_tf_dataset(data_dir, batch_size=batch_size, is_training=is_training, files=files)
+    results["tf_data"] = _measure(dataset.repeat(), num_batches, batch_size)
+
+    # Fill the cache with one pass over a subset, then measure reads served from it
+    paths, labels, class_indices = files
+    subset = (paths[:num_batches * batch_size], labels[:num_batches * batch_size], class_indices)
+    cached, _ = create_tf_dataset(data_dir, batch_size=batch_size, is_training=is_training, cache='memory', files=subset)
+    for _ in cached:
+        pass
+    results["tf_data_cached"] = _measure(cached.repeat(), num_batches, batch_size)
+
+    baseline = results["image_data_generator"]["images_per_sec"]
+    for name in ("tf_data", "tf_data_cached"):
+        results[name]["speedup"] = results[name]["images_per_sec"] / baseline if baseline else None
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ImageDataGenerator and tf.data training input throughput.")
+    parser.add_argument('--data-dir', default=TRAIN_DATA_DIR)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--no-augmentation', action='store_true', help="Benchmark the evaluation (non-augmented) pipelines.")
+    args = parser.parse_args()
+    results = benchmark_input_pipelines(args.data_dir, args.batches, args.batch_size, is_training=not args.no_augmentation)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SEED = 1234
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _multipart_image(image_bytes):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="image.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + image_bytes + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def _get_json(url, timeout=5):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+def _wait_until_ready(base_url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode} before becoming ready")
+        try:
+            status, report = _get_json(f'{base_url}/ready')
+            if status == 200:
+                return report
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Workers were not ready after {timeout}s")
+
+def _load_test(base_url, images, concurrency, requests_per_client):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(client_index):
+        local = []
+        for i in range(requests_per_client):
+            body, content_type = _multipart_image(images[(client_index + i) % len(images)])
+            request = urllib.request.Request(f'{base_url}/predict', data=body, headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                local.append(time.perf_counter() - start)
+            except OSError as e: # Includes HTTP error statuses
+                with lock:
+                    errors.append(str(e))
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) if latencies else np.zeros(1)
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000.0
+    return {"requests": int(len(latencies)), "errors": len(errors), "seconds": elapsed,
+            "per_sec": len(latencies) / elapsed if elapsed else 0.0, "p50_ms": float(p50), "p99_ms": float(p99)}
+
+def benchmark_worker_count(num_workers, backend, images, concurrency, requests_per_client, ready_timeout):
+    """Starts gunicorn with `num_workers` workers, waits for /ready, load-tests /predict and reports memory."""
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, SERVE_WORKERS=str(num_workers), SERVE_BIND=f'127.0.0.1:{port}',
+               INFERENCE_BACKEND=backend, PREDICTION_CACHE_SIZE='0', LOG_LEVEL='WARNING')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'src.api:app'],
+                               cwd=PROJECT_ROOT, env=env, start_new_session=True)
+    try:
+        start = time.perf_counter()
+        _wait_until_ready(base_url, process, ready_timeout)
+        startup_seconds = time.perf_counter() - start
+        throughput = _load_test(base_url, images, concurrency, requests_per_client)
+        # Memory is read after the load test, once every worker has run real batches
+        _, report = _get_json(f'{base_url}/ready')
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=60)
+
+    rss = [worker["rss_bytes"] for worker in report["workers"] if worker.get("rss_bytes")]
+    pss = [worker["pss_bytes"] for worker in report["workers"] if worker.get("pss_bytes")]
+    return dict(throughput, workers=num_workers, startup_seconds=startup_seconds,
+                rss_mb_per_worker=float(np.mean(rss)) / 2 ** 20 if rss else None,
+                pss_mb_per_worker=float(np.mean(pss)) / 2 ** 20 if pss else None,
+                pss_mb_total=float(np.sum(pss)) / 2 ** 20 if pss else None)
+
+def benchmark_serving(worker_counts, backend='keras', concurrency=32, requests_per_client=20, ready_timeout=300):
+    """
+    Measures /predict throughput and per-worker memory for each gunicorn worker count.
+    RSS counts shared pages in full for every worker; PSS divides them between the workers
+    sharing them, so pss_mb_total is the real combined footprint.
+    """
+    rng = np.random.default_rng(SEED)
+    images = []
+    for _ in range(16):
+        buffer = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, size=(375, 500, 3), dtype=np.uint8)).save(buffer, format='JPEG', quality=90)
+        images.append(buffer.getvalue())
+
+    results = {"backend": backend, "cpu_count": os.cpu_count(), "concurrency": concurrency, "runs": []}
+    for num_workers in worker_counts:
+        print(f"Benchmarking {num_workers} worker(s)...", file=sys.stderr)
+        results["runs"].append(benchmark_worker_count(num_workers, backend, images, concurrency,
+                                                      requests_per_client, ready_timeout))
+    base = results["runs"][0]["per_sec"] if results["runs"] else 0.0
+    for run in results["runs"]:
+        run["speedup"] = run["per_sec"] / base if base else None
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput scaling and memory per worker of the gunicorn deployment.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--backend', choices=('keras', 'tflite'), default='keras')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help="Requests per concurrent client.")
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    args = parser.parse_args()
+    results = benchmark_serving(args.workers, args.backend, args.concurrency, args.requests, args.ready_timeout)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
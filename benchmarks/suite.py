@@ -0,0 +1,316 @@
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Match the API: benchmarks run on the CPU, and the load test must not be served from the prediction cache
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+os.environ['PREDICTION_CACHE_SIZE'] = '0'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SEED = 1234
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+INSIGHTS_DATASET_SIZES = (1000, 10000, 100000)
+# Lower is better for latencies, higher is better for throughput
+LATENCY_KEYS = ('p50_ms', 'p99_ms')
+THROUGHPUT_KEYS = ('per_sec',)
+DEFAULT_MAX_REGRESSION = 0.10 # Fractional slowdown tolerated before a metric counts as a regression
+
+
+def summarize(latencies, items_per_call=1):
+    """Returns latency percentiles (ms) and throughput (items/sec) for per-call durations in seconds."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000.0
+    total = latencies.sum()
+    return {
+        "iterations": int(latencies.size),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(latencies.mean() * 1000.0),
+        "per_sec": float(latencies.size * items_per_call / total) if total else 0.0,
+    }
+
+def time_calls(function, iterations, warmup=3):
+    """Calls `function` `warmup` times untimed, then `iterations` times, returning each call's duration."""
+    for _ in range(warmup):
+        function()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def encode_image(rng, size=(500, 375), image_format='JPEG'):
+    """Returns an encoded random RGB image; 500x375 is a typical Cats vs. Dogs photo size."""
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+def make_synthetic_dataset(root, num_files, class_names=('cats', 'dogs'), image_bytes=None, seed=SEED):
+    """
+    Writes `num_files` images split evenly over <root>/<class>/. Every file holds the same
+    encoded image, which keeps setup fast while costing the same to read and decode.
+    """
+    image_bytes = image_bytes or encode_image(np.random.default_rng(seed))
+    for index in range(num_files):
+        class_dir = os.path.join(root, class_names[index % len(class_names)])
+        if index < len(class_names):
+            os.makedirs(class_dir, exist_ok=True)
+        with open(os.path.join(class_dir, f'{index}.jpg'), 'wb') as f:
+            f.write(image_bytes)
+    return root
+
+
+def bench_preprocess_single_image(config, work_dir):
+    from src.preprocessing import preprocess_single_image, preprocess_image_bytes
+
+    image_bytes = encode_image(np.random.default_rng(SEED))
+    image_path = os.path.join(work_dir, 'single.jpg')
+    with open(image_path, 'wb') as f:
+        f.write(image_bytes)
+    return {
+        "preprocess_single_image": summarize(time_calls(lambda: preprocess_single_image(image_path), config['iterations'])),
+        "preprocess_image_bytes": summarize(time_calls(lambda: preprocess_image_bytes(image_bytes), config['iterations'])),
+    }
+
+def _install_benchmark_model(work_dir):
+    """Serves a freshly initialized, seeded model so results do not depend on the trained weights on disk."""
+    import tensorflow as tf
+    from src.model import create_cnn_model, save_model_manifest
+    from src.prediction import load_serving_model, swap_serving_model
+
+    model_path = os.path.join(work_dir, 'benchmark_model.h5')
+    if not os.path.exists(model_path):
+        tf.keras.utils.set_random_seed(SEED)
+        model = create_cnn_model()
+        model.save(model_path)
+        save_model_manifest(model_path, {'cats': 0, 'dogs': 1}, model.input_shape[1:])
+    swap_serving_model(load_serving_model(model_path, version='benchmark', warm_up=True))
+
+def bench_predict(config, work_dir):
+    from src.prediction import predict_batch, predict_image
+    from src.preprocessing import IMG_HEIGHT, IMG_WIDTH
+
+    _install_benchmark_model(work_dir)
+    rng = np.random.default_rng(SEED)
+    results = {}
+    for batch_size in config['batch_sizes']:
+        batch = rng.random((batch_size, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+        # predict_image runs the forward pass on the whole batch; predict_batch also formats every result
+        iterations = max(3, config['iterations'] // max(1, batch_size // 8))
+        results[f"predict_image/batch_{batch_size}"] = summarize(
+            time_calls(lambda: predict_image(batch), iterations), items_per_call=batch_size)
+        results[f"predict_batch/batch_{batch_size}"] = summarize(
+            time_calls(lambda: predict_batch(batch), iterations), items_per_call=batch_size)
+    return results
+
+def bench_data_insights(config, work_dir):
+    from src.data_index import DatasetIndex
+
+    results = {}
+    image_bytes = encode_image(np.random.default_rng(SEED))
+    for num_files in config['insights_sizes']:
+        data_dir = make_synthetic_dataset(os.path.join(work_dir, f'insights_{num_files}'), num_files, image_bytes=image_bytes)
+        index_path = os.path.join(work_dir, f'insights_{num_files}.json')
+
+        start = time.perf_counter()
+        index = DatasetIndex(data_dir, index_path=index_path, min_refresh_interval=3600)
+        index.get_insights(path_prefix='train')
+        cold_seconds = time.perf_counter() - start
+
+        # A new process reusing the persisted index, with nothing changed on disk
+        start = time.perf_counter()
+        reloaded = DatasetIndex(data_dir, index_path=index_path, min_refresh_interval=3600)
+        reloaded.get_insights(path_prefix='train')
+        restart_seconds = time.perf_counter() - start
+
+        results[f"files_{num_files}"] = {
+            "cold_build_seconds": cold_seconds,
+            "restart_seconds": restart_seconds,
+            "rescan": summarize(time_calls(lambda: index.refresh(force=True), max(3, config['iterations'] // 10), warmup=1)),
+            "get_insights": summarize(time_calls(lambda: index.get_insights(path_prefix='train'), config['iterations'])),
+        }
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+def bench_data_generator(config, work_dir):
+    from src.preprocessing import create_data_generator
+
+    batch_size = 32
+    num_batches = config['generator_batches']
+    data_dir = make_synthetic_dataset(os.path.join(work_dir, 'generator'), batch_size * (num_batches + 2))
+    results = {}
+    for name, is_training in (("training", True), ("evaluation", False)):
+        generator, _ = create_data_generator(data_dir, batch_size=batch_size, is_training=is_training)
+        iterator = iter(generator)
+        results[name] = summarize(time_calls(lambda: next(iterator), num_batches, warmup=2), items_per_call=batch_size)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+def bench_flask_load(config, work_dir):
+    """Drives /predict through Flask's test client from concurrent threads, in process."""
+    from src.api import app
+
+    _install_benchmark_model(work_dir)
+    rng = np.random.default_rng(SEED)
+    images = [encode_image(rng) for _ in range(16)]
+    results = {}
+    for concurrency in config['concurrency']:
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        def worker(worker_index):
+            client = app.test_client()
+            local = []
+            for i in range(config['requests_per_worker']):
+                image_bytes = images[(worker_index + i) % len(images)]
+                start = time.perf_counter()
+                response = client.post('/predict', data={'file': (io.BytesIO(image_bytes), 'image.jpg')},
+                                       content_type='multipart/form-data')
+                local.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    with lock:
+                        failures.append(response.status_code)
+            with lock:
+                latencies.extend(local)
+
+        # One untimed request per worker so model tracing and thread start-up are not measured
+        warm = app.test_client()
+        warm.post('/predict', data={'file': (io.BytesIO(images[0]), 'image.jpg')}, content_type='multipart/form-data')
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        summary = summarize(latencies)
+        summary["per_sec"] = len(latencies) / elapsed if elapsed else 0.0 # Aggregate over all workers
+        summary["errors"] = len(failures)
+        results[f"predict/concurrency_{concurrency}"] = summary
+    return results
+
+BENCHMARKS = {
+    "preprocess": bench_preprocess_single_image,
+    "predict": bench_predict,
+    "data_insights": bench_data_insights,
+    "data_generator": bench_data_generator,
+    "flask_load": bench_flask_load,
+}
+
+def default_config(quick=False):
+    if quick:
+        return {"iterations": 20, "batch_sizes": (1, 8, 32), "insights_sizes": (1000,),
+                "generator_batches": 10, "concurrency": (1, 8), "requests_per_worker": 10}
+    return {"iterations": 100, "batch_sizes": BATCH_SIZES, "insights_sizes": INSIGHTS_DATASET_SIZES,
+            "generator_batches": 50, "concurrency": (1, 8, 32), "requests_per_worker": 25}
+
+def environment_info():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()}
+    try:
+        import tensorflow as tf
+        info["tensorflow"] = tf.__version__
+    except ImportError:
+        pass
+    try:
+        info["git_commit"] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                                            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+def run_suite(names=None, quick=False):
+    """Runs the selected benchmarks (all by default) and returns their results with environment details."""
+    config = default_config(quick)
+    results = {"created_at": time.time(), "quick": quick, "environment": environment_info(), "benchmarks": {}}
+    work_dir = tempfile.mkdtemp(prefix='ml-pipeline-bench-')
+    try:
+        for name in names or BENCHMARKS:
+            print(f"Running {name}...", file=sys.stderr)
+            start = time.perf_counter()
+            results["benchmarks"][name] = BENCHMARKS[name](config, work_dir)
+            print(f"  {name} finished in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def _flatten(tree, prefix=''):
+    for key, value in tree.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        else:
+            yield path, key, value
+
+def compare_results(current, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """
+    Compares p50/p99 latency and throughput of every benchmark present in both runs.
+    Returns a list of regressions, each a dict with the metric path, both values and the
+    relative change; a metric regresses when it is worse than baseline by more than `max_regression`.
+    """
+    baseline_values = {path: value for path, _, value in _flatten(baseline.get("benchmarks", {}))}
+    regressions = []
+    for path, key, value in _flatten(current.get("benchmarks", {})):
+        base = baseline_values.get(path)
+        if not isinstance(base, (int, float)) or not isinstance(value, (int, float)) or base <= 0:
+            continue
+        if key in LATENCY_KEYS:
+            change = value / base - 1.0
+        elif key in THROUGHPUT_KEYS:
+            change = base / value - 1.0 if value > 0 else float('inf')
+        else:
+            continue
+        if change > max_regression:
+            regressions.append({"metric": path, "baseline": base, "current": value, "regression": change})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the serving and training hot paths.")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Benchmarks to run (default: all).")
+    parser.add_argument('--quick', action='store_true', help="Smaller sizes and fewer iterations, for a fast check.")
+    parser.add_argument('--output', help="Write the results JSON here (default: stdout).")
+    parser.add_argument('--baseline', help="Results JSON of an earlier run to compare against.")
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="Tolerated fractional p50/p99 slowdown or throughput drop (default: 0.10).")
+    args = parser.parse_args()
+
+    results = run_suite(args.only, quick=args.quick)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.max_regression)
+        results["comparison"] = {"baseline": args.baseline, "max_regression": args.max_regression, "regressions": regressions}
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g} "
+                  f"({regression['regression']:+.1%})", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# Production serving: gunicorn -c gunicorn.conf.py src.api:app
+#
+# TensorFlow's runtime is not fork-safe, so the app is NOT preloaded in the master: every worker
+# imports TensorFlow and loads the model itself after the fork, with its TF/BLAS thread pools
+# capped at its share of the cores. With the TFLite export (INFERENCE_BACKEND=tflite) every worker
+# memory-maps the same read-only .tflite file, though XNNPACK still repacks float weights per worker.
+import os
+import shutil
+import tempfile
+
+from src.serving import (REQUEST_CAPACITY_ENV, STATE_DIR_ENV, WORKERS_ENV, default_worker_count,
+                         remove_worker_state, worker_thread_env)
+
+bind = os.environ.get('SERVE_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('SERVE_WORKERS', 0)) or default_worker_count()
+# Request threads per worker; concurrent /predict calls on one worker are batched into one forward pass.
+# Set SERVE_WORKER_CLASS=uvicorn.workers.UvicornWorker and serve src.asgi:application for the ASGI path.
+worker_class = os.environ.get('SERVE_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('SERVE_THREADS', 8))
+preload_app = False
+timeout = 120 # Each worker loads and warms up its model while booting
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # Workers inherit this environment: a shared directory for readiness reports, the expected
+    # worker count, and eager warm-up so a worker only reports ready once its model is warm
+    os.environ[STATE_DIR_ENV] = tempfile.mkdtemp(prefix='ml-api-workers-')
+    os.environ[WORKERS_ENV] = str(server.cfg.workers)
+    os.environ.setdefault('EAGER_MODEL_WARMUP', '1')
+
+def post_fork(server, worker):
+    # Runs in the worker before the app (and TensorFlow) is imported
+    os.environ.update(worker_thread_env(server.cfg.workers))
+    # src/asgi.py replaces this with its own thread and backlog counts under the ASGI worker class
+    os.environ[REQUEST_CAPACITY_ENV] = str(server.cfg.threads)
+
+def child_exit(server, worker):
+    remove_worker_state(worker.pid)
+
+def on_exit(server):
+    # Removes the readiness directory on_starting created
+    state_dir = os.environ.pop(STATE_DIR_ENV, None)
+    if state_dir:
+        shutil.rmtree(state_dir, ignore_errors=True)
@@ -1,10 +1,16 @@
-import kagglehub
+import argparse
+import errno
+import json
 import os
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import PIL
 from PIL import Image
 from sklearn.model_selection import train_test_split
 
+from src.data_index import IMAGE_EXTENSIONS
+
 # Define the dataset to download
 DATASET_ID = "shaunthesheep/microsoft-catsvsdogs-dataset"
 
@@ -18,6 +24,13 @@ TRAIN_DOGS_DIR = os.path.join(TRAIN_DIR, 'dogs')
 TEST_CATS_DIR = os.path.join(TEST_DIR, 'cats')
 TEST_DOGS_DIR = os.path.join(TEST_DIR, 'dogs')
 
+# Records validated source files and placed destination files, so interrupted runs resume
+MANIFEST_PATH = os.path.join(DATA_DIR, '.setup_manifest.json')
+MANIFEST_VERSION = 1
+MANIFEST_SAVE_INTERVAL = 1000 # Files placed between manifest checkpoints
+FICLONE = 0x40049409 # Linux ioctl that makes dst a copy-on-write clone (reflink) of src
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'copy')
+
 def setup_data_directories():
     """Creates the necessary data directories for the project."""
     os.makedirs(TRAIN_CATS_DIR, exist_ok=True)
@@ -39,18 +52,165 @@ def is_valid_image(filepath):
         print(f"Skipping corrupted or invalid image: {filepath} ({e})")
         return False
 
-def download_and_organize_kaggle_data():
+def _file_signature(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    """Returns the setup manifest of a previous run, or an empty one."""
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "validated": {}, "placed": {}}
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    """Writes the manifest atomically, so an interrupted write never loses the previous checkpoint."""
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def validate_images(filepaths, manifest, max_workers=None):
     """
-    Downloads the Kaggle dataset and organizes it into the project's
-    train/test/cats/dogs structure.
+    Returns the valid images among `filepaths`, checking them with is_valid_image in a
+    process pool. Results are remembered in the manifest by path, size and mtime, so
+    unchanged files are not opened again on later runs.
+    """
+    validated = manifest["validated"]
+    results = {}
+    pending = []
+    for filepath in filepaths:
+        try:
+            signature = _file_signature(filepath)
+        except OSError:
+            print(f"Skipping missing or zero-byte file: {filepath}")
+            continue
+        cached = validated.get(filepath)
+        if cached is not None and cached[:2] == signature:
+            results[filepath] = cached[2]
+        else:
+            pending.append((filepath, signature))
+
+    if pending:
+        print(f"Validating {len(pending)} images ({len(results)} already validated)...")
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            checks = pool.map(is_valid_image, [filepath for filepath, _ in pending], chunksize=64)
+            for (filepath, signature), valid in zip(pending, checks):
+                results[filepath] = valid
+                validated[filepath] = signature + [valid]
+    return sorted(filepath for filepath, valid in results.items() if valid)
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+def place_file(src, dst, link_mode='auto'):
+    """
+    Puts a copy of `src` at `dst` using the cheapest method the filesystem allows:
+    a reflink (copy-on-write clone), then a hardlink, then a regular copy. The file is
+    written under a temporary name and renamed, so `dst` is never left half-written.
+    Returns the method used.
+    """
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    methods = ('reflink', 'hardlink', 'copy') if link_mode == 'auto' else (link_mode,)
+    for method in methods:
+        try:
+            if method == 'reflink':
+                _reflink(src, tmp_path)
+            elif method == 'hardlink':
+                os.link(src, tmp_path)
+            else:
+                shutil.copy2(src, tmp_path)
+            os.replace(tmp_path, dst)
+            return method
+        except (OSError, ImportError) as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            unsupported = isinstance(e, ImportError) or e.errno in (
+                errno.EXDEV, errno.EPERM, errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL, errno.EMLINK, errno.ENOSYS)
+            if method == methods[-1] or not unsupported:
+                raise
+    raise ValueError(f"Unknown link mode: {link_mode}")
+
+def place_files(assignments, manifest, link_mode='auto', max_workers=None, manifest_path=MANIFEST_PATH):
+    """
+    Places every (src, dst) pair in a thread pool. Destinations that already hold a file of
+    the source's size, from this run or an earlier one, are skipped. Progress is checkpointed
+    to the manifest every MANIFEST_SAVE_INTERVAL files.
     """
+    placed = manifest["placed"]
+    todo = []
+    for src, dst in assignments:
+        if os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(src):
+            placed[dst] = src
+        else:
+            todo.append((src, dst))
+    print(f"Placing {len(todo)} images ({len(assignments) - len(todo)} already in place)...")
+
+    counts = {}
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for done, ((src, dst), method) in enumerate(zip(todo, pool.map(lambda pair: place_file(*pair, link_mode), todo)), 1):
+            placed[dst] = src
+            counts[method] = counts.get(method, 0) + 1
+            if done % MANIFEST_SAVE_INTERVAL == 0:
+                save_manifest(manifest, manifest_path)
+                print(f"  {done}/{len(todo)} images placed")
+    save_manifest(manifest, manifest_path)
+    return counts
+
+def keep_existing_split(train_images, test_images, train_dir, test_dir):
+    """
+    Moves images between the new train/test lists so that every image already present in
+    `train_dir` or `test_dir` (matched by file name) stays in the split it was placed in before.
+    Trees organized by an earlier version of this script may have been split differently, and
+    placing a file in the other split would leak test images into training.
+    Returns (train_images, test_images, number of images kept in their earlier split).
+    """
+    existing_train = set(os.listdir(train_dir)) if os.path.isdir(train_dir) else set()
+    existing_test = set(os.listdir(test_dir)) if os.path.isdir(test_dir) else set()
+    leaked = existing_train & existing_test
+    if leaked:
+        print(f"Warning: {len(leaked)} images are in both {train_dir} and {test_dir}; remove one copy of each.")
+
+    train, test = [], []
+    kept = 0
+    for img_path, new_split in [(path, 'train') for path in train_images] + [(path, 'test') for path in test_images]:
+        name = os.path.basename(img_path)
+        split = 'test' if name in existing_test else 'train' if name in existing_train else new_split
+        kept += split != new_split
+        (train if split == 'train' else test).append(img_path)
+    return train, test, kept
+
+def download_kaggle_data():
+    """Downloads the Kaggle dataset (or reuses kagglehub's cached copy) and returns its path."""
+    import kagglehub
+
     print(f"Downloading dataset: {DATASET_ID}...")
     # Download latest version
     kaggle_path = kagglehub.dataset_download(DATASET_ID)
     print(f"Dataset downloaded to: {kaggle_path}")
+    return kaggle_path
+
+def download_and_organize_kaggle_data(source_dir=None, link_mode='auto', max_workers=None, manifest_path=MANIFEST_PATH):
+    """
+    Downloads the Kaggle dataset and organizes it into the project's
+    train/test/cats/dogs structure. Pass `source_dir` (the dataset root or its
+    PetImages folder) to organize an existing local copy without downloading.
+    """
+    start = time.perf_counter()
+    kaggle_path = source_dir or download_kaggle_data()
 
     # The actual images are inside the 'PetImages' folder
     pet_images_dir = os.path.join(kaggle_path, 'PetImages')
+    if not os.path.exists(pet_images_dir) and os.path.basename(os.path.normpath(kaggle_path)) == 'PetImages':
+        pet_images_dir = kaggle_path
 
     if not os.path.exists(pet_images_dir):
         print(f"Error: Expected 'PetImages' directory not found at {pet_images_dir}")
@@ -67,8 +227,14 @@ def download_and_organize_kaggle_data():
         print(f"Contents of {pet_images_dir}: {os.listdir(pet_images_dir)}")
         return
 
-    all_cat_images = [os.path.join(cat_source_dir, f) for f in os.listdir(cat_source_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')) and is_valid_image(os.path.join(cat_source_dir, f))]
-    all_dog_images = [os.path.join(dog_source_dir, f) for f in os.listdir(dog_source_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')) and is_valid_image(os.path.join(dog_source_dir, f))]
+    manifest = load_manifest(manifest_path)
+    # Sorted, so the split below is the same on every run and a resumed run targets the same files
+    cat_candidates = sorted(os.path.join(cat_source_dir, f) for f in os.listdir(cat_source_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    dog_candidates = sorted(os.path.join(dog_source_dir, f) for f in os.listdir(dog_source_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    valid_images = set(validate_images(cat_candidates + dog_candidates, manifest, max_workers=max_workers))
+    save_manifest(manifest, manifest_path)
+    all_cat_images = [path for path in cat_candidates if path in valid_images]
+    all_dog_images = [path for path in dog_candidates if path in valid_images]
 
     print(f"Found {len(all_cat_images)} cat images and {len(all_dog_images)} dog images.")
 
@@ -79,23 +245,38 @@ def download_and_organize_kaggle_data():
     # Split data into training and testing sets
     train_cats, test_cats = train_test_split(all_cat_images, test_size=0.2, random_state=42)
     train_dogs, test_dogs = train_test_split(all_dog_images, test_size=0.2, random_state=42)
+    # A re-run over an existing tree keeps each image in the split it already has
+    train_cats, test_cats, kept_cats = keep_existing_split(train_cats, test_cats, TRAIN_CATS_DIR, TEST_CATS_DIR)
+    train_dogs, test_dogs, kept_dogs = keep_existing_split(train_dogs, test_dogs, TRAIN_DOGS_DIR, TEST_DOGS_DIR)
+    if kept_cats or kept_dogs:
+        print(f"Kept {kept_cats + kept_dogs} images in the split an earlier run placed them in.")
 
     print(f"Splitting into:\n  Cats: {len(train_cats)} train, {len(test_cats)} test\n  Dogs: {len(train_dogs)} train, {len(test_dogs)} test")
 
-    # Copy images to project's train/test directories
-    for img_path in train_cats:
-        shutil.copy(img_path, os.path.join(TRAIN_CATS_DIR, os.path.basename(img_path)))
-    for img_path in train_dogs:
-        shutil.copy(img_path, os.path.join(TRAIN_DOGS_DIR, os.path.basename(img_path)))
+    # Link or copy images into project's train/test directories
+    assignments = []
+    for images, target_dir in ((train_cats, TRAIN_CATS_DIR), (train_dogs, TRAIN_DOGS_DIR),
+                               (test_cats, TEST_CATS_DIR), (test_dogs, TEST_DOGS_DIR)):
+        assignments.extend((img_path, os.path.join(target_dir, os.path.basename(img_path))) for img_path in images)
+    counts = place_files(assignments, manifest, link_mode=link_mode, max_workers=max_workers, manifest_path=manifest_path)
 
-    for img_path in test_cats:
-        shutil.copy(img_path, os.path.join(TEST_CATS_DIR, os.path.basename(img_path)))
-    for img_path in test_dogs:
-        shutil.copy(img_path, os.path.join(TEST_DOGS_DIR, os.path.basename(img_path)))
+    print(f"Images successfully organized into project's data directories in {time.perf_counter() - start:.1f}s "
+          f"({', '.join(f'{count} {method}' for method, count in sorted(counts.items())) or 'nothing to do'}).")
 
-    print("Images successfully organized into project's data directories.")
+def main():
+    parser = argparse.ArgumentParser(description="Download the Cats vs. Dogs dataset and organize it into data/train and data/test.")
+    parser.add_argument('--source', default=None,
+                        help="Local copy of the dataset (its root or PetImages folder); skips the Kaggle download.")
+    parser.add_argument('--link-mode', choices=LINK_MODES, default='auto',
+                        help="How files are placed: 'auto' tries reflink, then hardlink, then copy.")
+    parser.add_argument('--workers', type=int, default=None, help="Validation processes and copy threads.")
+    parser.add_argument('--manifest', default=MANIFEST_PATH, help="Progress manifest used to resume interrupted runs.")
+    args = parser.parse_args()
+
+    setup_data_directories()
+    download_and_organize_kaggle_data(source_dir=args.source, link_mode=args.link_mode,
+                                      max_workers=args.workers, manifest_path=args.manifest)
 
 # This block ensures the functions are called when the script is executed directly
 if __name__ == "__main__":
-    setup_data_directories()
-    download_and_organize_kaggle_data()
\ No newline at end of file
+    main()
@@ -0,0 +1,76 @@
+import math
+import threading
+import time
+
+# Set in the WSGI environ of requests already admitted by src/asgi.py's AdmissionMiddleware,
+# so the Flask app does not count them against the endpoint limits a second time
+ADMITTED_ENVIRON_KEY = 'ml_api.admitted'
+
+
+class EndpointLimiter:
+    """
+    Bounds the concurrent requests of one endpoint.
+
+    Up to `max_concurrent` requests run at once. Up to `max_queued` more may wait for a slot,
+    at most `queue_timeout` seconds each; anything beyond that is rejected immediately, so an
+    overloaded endpoint sheds load in microseconds instead of building an unbounded backlog.
+    """
+
+    def __init__(self, name, max_concurrent, max_queued=0, queue_timeout=1.0):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        self._admitted_total = 0
+        self._rejected_total = 0
+
+    def acquire(self):
+        """Takes a slot, waiting in the admission queue if there is room. Returns False if rejected."""
+        with self._condition:
+            if self._active < self.max_concurrent:
+                self._active += 1
+                self._admitted_total += 1
+                return True
+            if self._queued >= self.max_queued:
+                self._rejected_total += 1
+                return False
+
+            self._queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected_total += 1
+                        return False
+                    self._condition.wait(remaining)
+                self._active += 1
+                self._admitted_total += 1
+                return True
+            finally:
+                self._queued -= 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def retry_after_seconds(self):
+        """Whole seconds a rejected client should wait before retrying (for the Retry-After header)."""
+        return max(1, math.ceil(self.queue_timeout))
+
+    def stats(self):
+        with self._condition:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "admitted_total": self._admitted_total,
+                "rejected_total": self._rejected_total,
+            }
@@ -2,18 +2,44 @@ import os
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1' # Force TensorFlow to use CPU
 
 # Ensure all necessary Flask components are imported, including send_from_directory
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context, g
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+import json
+import logging
 import shutil
-import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from flask_cors import CORS
 import numpy as np # Import numpy with alias 'np'
-from PIL import Image # Import Image from Pillow
 
 # Import functions from our src modules
-from src.preprocessing import preprocess_single_image, load_and_preprocess_bulk_data, create_data_generator
-from src.model import create_cnn_model, train_model
-from src.prediction import load_ml_model, predict_image
+from src.preprocessing import IMG_HEIGHT, IMG_WIDTH, preprocess_image_bytes, decode_image_bytes, normalize_image
+from src.model import create_cnn_model, save_model_manifest
+from src.prediction import (predict_batch, warm_up_model, get_model_stats, get_model_version, activate_model_version,
+                            load_model_version, get_serving_model, model_registry, INFERENCE_BACKEND)
+from src.batching import BatchingEngine
+from src.cache import PredictionCache
+from src.data_index import DatasetIndex, IMAGE_EXTENSIONS
+from src.jobs import RetrainJobManager
+from src.metrics import (HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT, PREDICT_STAGE_DURATION,
+                         PREDICTION_ERRORS, PREDICTION_CACHE_LOOKUPS, BATCH_QUEUE_DEPTH, REQUESTS_REJECTED,
+                         REGISTRY, render_metrics)
+from src.admission import ADMITTED_ENVIRON_KEY, EndpointLimiter
+from src.thumbnails import ThumbnailCache
+from src.evaluation import check_promotion, evaluate_serving_model, summarize
+from src.registry import TFLITE_FILENAME
+from src.serving import (REQUEST_CAPACITY_ENV, apply_thread_limits, is_multi_worker, mark_worker_ready, readiness,
+                         read_metrics_snapshots, start_metrics_snapshots, start_model_sync)
+
+# Under gunicorn (gunicorn.conf.py), cap this worker's TensorFlow thread pools before any op runs
+apply_thread_limits()
+
+# Leveled logging replaces unconditional prints; LOG_LEVEL=DEBUG restores the verbose output
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
@@ -23,12 +49,124 @@ CORS(app)
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, 'uploads')
 RETRAIN_DATA_FOLDER = os.path.join(PROJECT_ROOT, 'retrain_data')
+# Shared by every worker: the retraining queue, job statuses and the lock that runs one job at a time
+RETRAIN_JOBS_DIR = os.environ.get('RETRAIN_JOBS_DIR') or os.path.join(RETRAIN_DATA_FOLDER, 'jobs')
 MODEL_PATH = os.path.join(PROJECT_ROOT, 'models', 'image_classifier_model.h5')
 DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
+CACHE_DIR = os.path.join(PROJECT_ROOT, 'cache')
 # --- END OF CHANGES ---
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'zip'}
 
+# Load the model and run a dummy forward pass at startup instead of on the first request
+EAGER_MODEL_WARMUP = os.environ.get('EAGER_MODEL_WARMUP', '0') == '1'
+# With several gunicorn workers, each one follows the registry's CURRENT version at this interval
+MODEL_SYNC_SECONDS = float(os.environ.get('MODEL_SYNC_SECONDS', 5))
+# ... and publishes its metrics for /metrics on the other workers at this interval; every sample is
+# labelled with the worker's pid, so the workers' counters stay separate series
+METRICS_SNAPSHOT_SECONDS = float(os.environ.get('METRICS_SNAPSHOT_SECONDS', 5))
+WORKER_METRIC_LABELS = (('worker', str(os.getpid())),)
+
+# Retraining runs as a background job in a separate, lower-priority process with a capped thread count
+RETRAIN_EPOCHS = int(os.environ.get('RETRAIN_EPOCHS', 10))
+RETRAIN_NUM_THREADS = int(os.environ.get('RETRAIN_NUM_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+RETRAIN_NICENESS = int(os.environ.get('RETRAIN_NICENESS', 10))
+RETRAIN_INPUT_PIPELINE = os.environ.get('RETRAIN_INPUT_PIPELINE', 'generator') # 'generator' or 'tf_data'
+RETRAIN_DATA_SOURCE = os.environ.get('RETRAIN_DATA_SOURCE', 'extract') # 'extract' or 'zip_stream'
+# 'scratch' trains a new model; 'fine_tune' continues training the serving model on the upload plus replayed old data
+RETRAIN_MODE = os.environ.get('RETRAIN_MODE', 'scratch')
+RETRAIN_FREEZE_CONV = os.environ.get('RETRAIN_FREEZE_CONV', '1') == '1'
+RETRAIN_REPLAY_RATIO = float(os.environ.get('RETRAIN_REPLAY_RATIO', 1.0))
+RETRAIN_MAX_REPLAY_SAMPLES = int(os.environ.get('RETRAIN_MAX_REPLAY_SAMPLES', 2000))
+RETRAIN_VALIDATION_SPLIT = float(os.environ.get('RETRAIN_VALIDATION_SPLIT', 0.2))
+RETRAIN_EARLY_STOPPING_PATIENCE = int(os.environ.get('RETRAIN_EARLY_STOPPING_PATIENCE', 2))
+# Retrained versions get a model.tflite export when serving with the TFLite backend (or RETRAIN_EXPORT_TFLITE=1),
+# quantized as RETRAIN_TFLITE_QUANTIZATION says ('float32', 'dynamic' or 'int8', calibrated on data/train)
+RETRAIN_EXPORT_TFLITE = os.environ.get('RETRAIN_EXPORT_TFLITE', '1' if INFERENCE_BACKEND == 'tflite' else '0') == '1'
+RETRAIN_TFLITE_QUANTIZATION = os.environ.get('RETRAIN_TFLITE_QUANTIZATION', 'float32')
+if RETRAIN_TFLITE_QUANTIZATION not in ('float32', 'dynamic', 'int8'):
+    raise ValueError(f"RETRAIN_TFLITE_QUANTIZATION must be 'float32', 'dynamic' or 'int8', not {RETRAIN_TFLITE_QUANTIZATION!r}")
+
+# Micro-batching of concurrent /predict calls into a single forward pass
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 32))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+inference_engine = BatchingEngine(predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+BATCH_QUEUE_DEPTH.set_function(inference_engine.queue_depth)
+# Let Pillow downscale JPEGs while decoding (faster, but not bit-identical to the file-based path)
+PREDICT_JPEG_DRAFT = os.environ.get('PREDICT_JPEG_DRAFT', '0') == '1'
+
+# Results cache keyed by upload content hash + model version (PREDICTION_CACHE_SIZE=0 disables it)
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_MAX_MB = float(os.environ.get('PREDICTION_CACHE_MAX_MB', 64))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 0)) or None
+PREDICTION_CACHE_DIR = os.environ.get('PREDICTION_CACHE_DIR') or None
+prediction_cache = PredictionCache(max_entries=PREDICTION_CACHE_SIZE,
+                                   max_bytes=int(PREDICTION_CACHE_MAX_MB * 1024 * 1024),
+                                   ttl_seconds=PREDICTION_CACHE_TTL,
+                                   disk_dir=PREDICTION_CACHE_DIR)
+
+# /data-insights is served from a persistent dataset index, rescanned at most every DATA_INDEX_REFRESH_SECONDS
+DATA_INDEX_REFRESH_SECONDS = float(os.environ.get('DATA_INDEX_REFRESH_SECONDS', 30))
+train_data_index = DatasetIndex(os.path.join(DATA_DIR, 'train'),
+                                index_path=os.path.join(CACHE_DIR, 'train_index.json'),
+                                min_refresh_interval=DATA_INDEX_REFRESH_SECONDS)
+
+# /data-images?size=N serves thumbnails generated on demand and cached on disk; every response
+# carries ETag/Last-Modified, so browsers revalidate with a cheap 304
+THUMBNAIL_SIZES = tuple(int(size) for size in os.environ.get('THUMBNAIL_SIZES', '64,128,256').split(','))
+THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR') or os.path.join(CACHE_DIR, 'thumbnails')
+DATA_IMAGE_MAX_AGE = int(os.environ.get('DATA_IMAGE_MAX_AGE', 3600))
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, sizes=THUMBNAIL_SIZES)
+
+# Test-set evaluation (POST /evaluate). With PROMOTION_GATE=1 a retrained model is only activated if
+# its data/test accuracy is at least PROMOTION_MIN_ACCURACY and at most PROMOTION_MAX_ACCURACY_DROP
+# below the serving model's. Predictions are cached per model version, so re-evaluations are cheap.
+TEST_DATA_DIR = os.path.join(DATA_DIR, 'test')
+EVALUATION_BATCH_SIZE = int(os.environ.get('EVALUATION_BATCH_SIZE', 256))
+PROMOTION_GATE = os.environ.get('PROMOTION_GATE', '0') == '1'
+PROMOTION_MIN_ACCURACY = float(os.environ.get('PROMOTION_MIN_ACCURACY', 0.0))
+PROMOTION_MAX_ACCURACY_DROP = float(os.environ.get('PROMOTION_MAX_ACCURACY_DROP', 0.01))
+
+# Bulk scoring through /predict/batch
+# The project's image extensions, plus GIF, which Pillow decodes for uploads (but training does not read)
+UPLOAD_IMAGE_EXTENSIONS = IMAGE_EXTENSIONS + ('.gif',)
+BATCH_PREDICT_CHUNK_SIZE = int(os.environ.get('BATCH_PREDICT_CHUNK_SIZE', 64))
+BATCH_PREDICT_MAX_IMAGES = int(os.environ.get('BATCH_PREDICT_MAX_IMAGES', 5000))
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+# Chunk-level read-ahead runs on its own pool because it waits on decode_pool tasks
+chunk_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chunk-prefetch')
+
+# Admission control: per-endpoint concurrency limits with a short bounded wait, upload size caps,
+# and 503s while the inference queue is saturated. Rejected requests get a Retry-After header.
+# Under gunicorn or src.asgi the /predict defaults follow the requests a worker can actually hold.
+# Requests waiting on the batching queue while a forward pass runs are what fill the next batch,
+# so the queue only counts as saturated once the whole capacity is waiting on it.
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 1.0))
+REQUEST_CAPACITY = int(os.environ.get(REQUEST_CAPACITY_ENV, 0)) or None
+INFERENCE_QUEUE_LIMIT = int(os.environ.get('INFERENCE_QUEUE_LIMIT', 0)) or (
+    REQUEST_CAPACITY or BATCH_MAX_SIZE * 4)
+endpoint_limiters = {
+    'predict': EndpointLimiter('predict', int(os.environ.get('PREDICT_MAX_CONCURRENCY', REQUEST_CAPACITY or 128)),
+                               max_queued=int(os.environ.get('PREDICT_MAX_QUEUED', REQUEST_CAPACITY or 128)),
+                               queue_timeout=ADMISSION_QUEUE_TIMEOUT),
+    'predict_batch_endpoint': EndpointLimiter('predict_batch_endpoint', int(os.environ.get('BATCH_PREDICT_MAX_CONCURRENCY', 2)),
+                                              max_queued=2, queue_timeout=ADMISSION_QUEUE_TIMEOUT),
+    'retrain': EndpointLimiter('retrain', int(os.environ.get('RETRAIN_MAX_CONCURRENT_UPLOADS', 2)), queue_timeout=0),
+    'evaluate': EndpointLimiter('evaluate', 1, queue_timeout=0), # One test-set evaluation at a time per worker
+}
+MAX_UPLOAD_BYTES = {
+    'predict': int(float(os.environ.get('PREDICT_MAX_UPLOAD_MB', 10)) * 1024 * 1024),
+    'predict_batch_endpoint': int(float(os.environ.get('BATCH_PREDICT_MAX_UPLOAD_MB', 512)) * 1024 * 1024),
+    'retrain': int(float(os.environ.get('RETRAIN_MAX_UPLOAD_MB', 2048)) * 1024 * 1024),
+}
+# Hard cap for every request, also enforced while reading bodies sent without a Content-Length
+app.config['MAX_CONTENT_LENGTH'] = max(MAX_UPLOAD_BYTES.values())
+if REQUEST_CAPACITY and INFERENCE_QUEUE_LIMIT > min(REQUEST_CAPACITY, endpoint_limiters['predict'].max_concurrent):
+    logger.warning("INFERENCE_QUEUE_LIMIT=%d can never be reached: this worker holds at most %d /predict requests, "
+                   "so /predict will not shed load on queue depth", INFERENCE_QUEUE_LIMIT,
+                   min(REQUEST_CAPACITY, endpoint_limiters['predict'].max_concurrent))
+
 # Ensure all necessary directories exist at startup
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RETRAIN_DATA_FOLDER, exist_ok=True)
@@ -45,156 +183,477 @@ def allowed_file(filename):
 def home():
     return "ML Pipeline API is running!"
 
+# Histogram children of the /predict stages, bound once instead of looked up per request
+PREDICT_STAGES = {stage: PREDICT_STAGE_DURATION.labels(stage=stage)
+                  for stage in ('receive', 'decode', 'normalize', 'serialize')}
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    g.metrics_start = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+@app.after_request
+def count_request(response):
+    HTTP_REQUESTS.labels(endpoint=g.get('metrics_endpoint', 'unmatched'), status=response.status_code).inc()
+    g.metrics_counted = True
+    return response
+
+def _reject(endpoint, reason, status, message, retry_after=None):
+    REQUESTS_REJECTED.labels(endpoint=endpoint, reason=reason).inc()
+    response = jsonify({"error": message})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def admit_request():
+    """
+    Sheds load before the request body is read: oversized uploads get 413, a saturated
+    inference queue gets 503 and an endpoint at its concurrency limit gets 429. Requests served
+    through src.asgi have already been through these checks in its AdmissionMiddleware.
+    """
+    endpoint = request.endpoint
+    limiter = endpoint_limiters.get(endpoint)
+    if limiter is None or request.method != 'POST':
+        return None
+    max_bytes = MAX_UPLOAD_BYTES.get(endpoint)
+    if max_bytes is not None:
+        # Also stops bodies sent without a Content-Length at the endpoint's cap while they are read
+        request.max_content_length = max_bytes
+    if request.environ.get(ADMITTED_ENVIRON_KEY):
+        return None
+    if max_bytes is not None and request.content_length is not None and request.content_length > max_bytes:
+        return _reject(endpoint, 'too_large', 413, f"Upload too large: {request.content_length} bytes (limit is {max_bytes})")
+    if endpoint == 'predict' and inference_engine.queue_depth() >= INFERENCE_QUEUE_LIMIT:
+        retry_after = max(1, int(inference_engine.estimated_wait_seconds() + 0.999))
+        return _reject(endpoint, 'saturated', 503, "The inference queue is full; retry later.", retry_after)
+    if not limiter.acquire():
+        return _reject(endpoint, 'busy', 429, "Too many concurrent requests; retry later.", limiter.retry_after_seconds())
+    g.admission_limiter = limiter
+    return None
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return _reject(request.endpoint or 'unmatched', 'too_large', 413,
+                   f"Upload too large (limit is {request.max_content_length} bytes)")
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # Runs after a streamed response has been fully sent, so its duration covers the whole stream
+    limiter = g.pop('admission_limiter', None)
+    if limiter is not None:
+        limiter.release()
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is None:
+        return
+    # Unhandled exceptions normally reach count_request as a 500 response; count here only
+    # when no response was produced at all (e.g. the exception was propagated)
+    if error is not None and not g.pop('metrics_counted', False):
+        HTTP_REQUESTS.labels(endpoint=endpoint, status=500).inc()
+    HTTP_REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+    HTTP_REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - g.pop('metrics_start'))
+
+def _observe_stage(stage, start):
+    """Records the time since `start` for a /predict stage and returns the current time."""
+    now = time.perf_counter()
+    PREDICT_STAGES[stage].observe(now - start)
+    return now
+
 @app.route('/predict', methods=['POST'])
 def predict():
+    stage_start = time.perf_counter()
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        # Decode straight from the upload stream; nothing is written to UPLOAD_FOLDER
+        image_bytes = file.read()
+        stage_start = _observe_stage('receive', stage_start)
 
         try:
-            preprocessed_image = preprocess_single_image(filepath)
-            prediction_result = predict_image(preprocessed_image)
-            return jsonify(prediction_result)
+            cache_key = None
+            if prediction_cache.enabled:
+                cache_key = prediction_cache.make_key(image_bytes, get_model_version())
+                cached_result = prediction_cache.get(cache_key)
+                PREDICTION_CACHE_LOOKUPS.labels(result='miss' if cached_result is None else 'hit').inc()
+                if cached_result is not None:
+                    return jsonify(cached_result)
+
+            image_array = decode_image_bytes(image_bytes, use_draft=PREDICT_JPEG_DRAFT)
+            stage_start = _observe_stage('decode', stage_start)
+            preprocessed_image = normalize_image(image_array)
+            _observe_stage('normalize', stage_start)
+            prediction_result = inference_engine.submit(preprocessed_image) # Forward time is recorded per batch
+            if cache_key is not None:
+                prediction_cache.put(cache_key, prediction_result)
+            stage_start = time.perf_counter()
+            response = jsonify(prediction_result)
+            _observe_stage('serialize', stage_start)
+            return response
         except FileNotFoundError as e:
+            PREDICTION_ERRORS.labels(endpoint='predict').inc()
             return jsonify({"error": str(e)}), 500
         except Exception as e:
-            print(f"Prediction error: {str(e)}") # Log the actual error
+            PREDICTION_ERRORS.labels(endpoint='predict').inc()
+            logger.exception("Prediction error: %s", e)
             return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
-        finally:
-            os.remove(filepath) # Clean up uploaded file
     return jsonify({"error": "File type not allowed"}), 400
 
+def _is_image_name(name):
+    base = os.path.basename(name)
+    return bool(base) and not base.startswith('.') and base.lower().endswith(UPLOAD_IMAGE_EXTENSIONS)
+
+def _decode_into(read_bytes, out):
+    """Reads and decodes one image into `out`; returns an error message instead of raising."""
+    try:
+        preprocess_image_bytes(read_bytes(), out=out, use_draft=PREDICT_JPEG_DRAFT)
+        return None
+    except Exception as e:
+        return f"Could not decode image: {e}"
+
+def _decode_chunk(items):
+    """Decodes a chunk of (name, read_bytes) items in parallel into one stacked float32 array."""
+    batch = np.empty((len(items), IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+    errors = list(decode_pool.map(lambda i: _decode_into(items[i][1], batch[i]), range(len(items))))
+    return batch, errors
+
+def _score_chunk(start, items, decoded):
+    batch, errors = decoded
+    valid = [i for i, error in enumerate(errors) if error is None]
+    if len(valid) == len(items):
+        predictions = predict_batch(batch)
+    else:
+        predictions = predict_batch(batch[valid]) if valid else []
+    results = dict(zip(valid, predictions))
+    if len(valid) != len(items):
+        PREDICTION_ERRORS.labels(endpoint='predict_batch_endpoint').inc(len(items) - len(valid))
+    lines = []
+    for i, (name, _) in enumerate(items):
+        record = {"index": start + i, "filename": name}
+        if i in results:
+            record.update(results[i])
+        else:
+            record["error"] = errors[i]
+        lines.append(json.dumps(record) + "\n")
+    return "".join(lines)
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_endpoint():
+    """
+    Classifies many images in one request, streaming one NDJSON line per image as each chunk finishes.
+    Accepts any number of image files under `files` and/or a zip archive of images under `archive`.
+    """
+    files = [file for file in request.files.getlist('files') if file.filename and _is_image_name(file.filename)]
+
+    archive = None
+    members = []
+    archive_file = request.files.get('archive')
+    if archive_file is not None and archive_file.filename:
+        try:
+            archive = zipfile.ZipFile(archive_file.stream)
+        except zipfile.BadZipFile:
+            return jsonify({"error": "The uploaded archive is not a valid zip file"}), 400
+        members = [member.filename for member in archive.infolist()
+                   if not member.is_dir() and not member.filename.startswith('__MACOSX/') and _is_image_name(member.filename)]
+
+    # Counted before any file is read into memory
+    num_images = len(files) + len(members)
+    if not num_images:
+        if archive is not None:
+            archive.close()
+        return jsonify({"error": "No image files found in the request"}), 400
+    if num_images > BATCH_PREDICT_MAX_IMAGES:
+        if archive is not None:
+            archive.close()
+        return jsonify({"error": f"Too many images: {num_images} (limit is {BATCH_PREDICT_MAX_IMAGES})"}), 400
+
+    items = []
+    for file in files:
+        image_bytes = file.read()
+        items.append((file.filename, lambda data=image_bytes: data))
+    items.extend((name, lambda name=name: archive.read(name)) for name in members)
+
+    def generate():
+        try:
+            chunks = [(start, items[start:start + BATCH_PREDICT_CHUNK_SIZE])
+                      for start in range(0, len(items), BATCH_PREDICT_CHUNK_SIZE)]
+            decoded = _decode_chunk(chunks[0][1])
+            for position, (start, chunk) in enumerate(chunks):
+                # Decode the next chunk in the background while the model scores this one
+                next_decoded = None
+                if position + 1 < len(chunks):
+                    next_decoded = chunk_prefetch_pool.submit(_decode_chunk, chunks[position + 1][1])
+                try:
+                    yield _score_chunk(start, chunk, decoded)
+                except Exception as e:
+                    PREDICTION_ERRORS.labels(endpoint='predict_batch_endpoint').inc(len(chunk))
+                    logger.exception("Batch prediction error: %s", e)
+                    yield "".join(json.dumps({"index": start + i, "filename": name, "error": f"Prediction failed: {str(e)}"}) + "\n"
+                                  for i, (name, _) in enumerate(chunk))
+                if next_decoded is not None:
+                    decoded = next_decoded.result()
+        finally:
+            if archive is not None:
+                archive.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/inference-stats', methods=['GET'])
+def inference_stats():
+    """Reports batching queue depth, batch-size histogram, per-request latency and model cold-start time."""
+    stats = inference_engine.stats()
+    stats["model"] = get_model_stats()
+    stats["cache"] = prediction_cache.stats()
+    stats["thumbnails"] = thumbnail_cache.stats()
+    stats["admission"] = {name: limiter.stats() for name, limiter in endpoint_limiters.items()}
+    return jsonify(stats)
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 once every serving worker has loaded and warmed up its model, 503 before.
+    Reports each worker's model version and memory (RSS and PSS).
+    """
+    is_ready, report = readiness(get_model_stats())
+    return jsonify(report), 200 if is_ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exposes request, per-stage latency, cache, error and model metrics in the Prometheus text format.
+    With several workers, every worker's metrics are included, labelled with its pid.
+    """
+    if not is_multi_worker():
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
+    body, content_type = render_metrics(WORKER_METRIC_LABELS, read_metrics_snapshots())
+    return Response(body, content_type=content_type)
+
+def run_promotion_gate(candidate):
+    """
+    Evaluates a candidate ServingModel and the serving model on data/test.
+    Returns (passed, reasons, candidate_report).
+    """
+    candidate_report = evaluate_serving_model(candidate, data_dir=TEST_DATA_DIR, batch_size=EVALUATION_BATCH_SIZE)
+    try:
+        baseline_report = evaluate_serving_model(get_serving_model(), data_dir=TEST_DATA_DIR,
+                                                 batch_size=EVALUATION_BATCH_SIZE)
+    except FileNotFoundError:
+        baseline_report = None # Nothing is serving yet, so only the absolute threshold applies
+    passed, reasons = check_promotion(candidate_report, baseline_report, min_accuracy=PROMOTION_MIN_ACCURACY,
+                                      max_accuracy_drop=PROMOTION_MAX_ACCURACY_DROP)
+    return passed, reasons, candidate_report
+
+def activate_retrained_model(job):
+    """
+    Publishes a finished job's model as a new registry version, then loads and warms it up
+    while the old model keeps serving, and swaps it in. Returns fields to record on the job.
+    With PROMOTION_GATE, the version is only activated if it passes run_promotion_gate;
+    a rejected version stays in the registry and can still be activated by hand.
+    """
+    metadata = {key: job.get(key) for key in ('job_id', 'mode', 'base_model_path', 'samples', 'new_classes', 'epochs',
+                                              'loss', 'accuracy', 'val_loss', 'val_accuracy', 'tflite_quantization')}
+    extra_files = {TFLITE_FILENAME: job["tflite_model_path"]} if job.get("tflite_model_path") else None
+    version = model_registry.publish(job["model_path"], metadata=metadata, extra_files=extra_files)
+    result = {"model_version": version}
+    candidate = None
+    if PROMOTION_GATE:
+        candidate = load_model_version(version)
+        passed, reasons, report = run_promotion_gate(candidate)
+        result["evaluation"] = summarize(report)
+        if not passed:
+            logger.warning("Retrained model %s from job %s was not promoted: %s", version, job['job_id'], "; ".join(reasons))
+            return dict(result, promoted=False, rejection_reasons=reasons)
+    activate_model_version(version, serving=candidate)
+    # Results of the old model are keyed by its version and can no longer be hit
+    prediction_cache.clear()
+    mark_worker_ready(get_model_stats())
+    logger.info("Retrained model from job %s is now serving as version %s", job['job_id'], version)
+    return dict(result, promoted=True)
+
+def resolve_fine_tuning_base():
+    """Returns the Keras model a fine-tuning job starts from: the registry's CURRENT version, else the legacy model."""
+    model_path, _ = model_registry.resolve_model_path('keras')
+    return model_path or MODEL_PATH
+
+retrain_jobs = RetrainJobManager(RETRAIN_JOBS_DIR, on_model_ready=activate_retrained_model,
+                                 epochs=RETRAIN_EPOCHS, num_threads=RETRAIN_NUM_THREADS, niceness=RETRAIN_NICENESS,
+                                 input_pipeline=RETRAIN_INPUT_PIPELINE, data_source=RETRAIN_DATA_SOURCE,
+                                 mode=RETRAIN_MODE, base_model_resolver=resolve_fine_tuning_base,
+                                 replay_data_dir=os.path.join(DATA_DIR, 'train'), replay_ratio=RETRAIN_REPLAY_RATIO,
+                                 max_replay_samples=RETRAIN_MAX_REPLAY_SAMPLES, validation_split=RETRAIN_VALIDATION_SPLIT,
+                                 freeze_conv=RETRAIN_FREEZE_CONV, early_stopping_patience=RETRAIN_EARLY_STOPPING_PATIENCE,
+                                 tflite_quantization=RETRAIN_TFLITE_QUANTIZATION if RETRAIN_EXPORT_TFLITE else None,
+                                 tflite_calibration_dir=os.path.join(DATA_DIR, 'train'))
+
 @app.route('/retrain', methods=['POST'])
 def retrain():
+    """
+    Queues a retraining job and returns its id immediately (202).
+    Progress is reported by GET /retrain/<job_id>; the current model keeps serving until the job completes.
+    An optional `mode` form field ('scratch' or 'fine_tune') overrides RETRAIN_MODE for this job.
+    """
     if 'data_zip' not in request.files:
         return jsonify({"error": "No data_zip file part"}), 400
     zip_file = request.files['data_zip']
     if zip_file.filename == '':
         return jsonify({"error": "No selected zip file"}), 400
+    mode = request.form.get('mode') or RETRAIN_MODE
+    if mode not in ('scratch', 'fine_tune'):
+        return jsonify({"error": f"Unknown retraining mode: {mode}. Use 'scratch' or 'fine_tune'."}), 400
     if zip_file and allowed_file(zip_file.filename):
-        filename = secure_filename(zip_file.filename)
-        zip_filepath = os.path.join(RETRAIN_DATA_FOLDER, filename)
+        job_id, job_dir = retrain_jobs.create_job_dir()
+        zip_filepath = os.path.join(job_dir, secure_filename(zip_file.filename))
         zip_file.save(zip_filepath)
+        if not zipfile.is_zipfile(zip_filepath):
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return jsonify({"error": "The uploaded file is not a valid zip file"}), 400
 
-        extracted_data_dir = None
-
-        try:
-            print(f"Received zip file: {zip_filepath}")
-            # Pass DATA_DIR to load_and_preprocess_bulk_data if it needs to know the project root
-            extracted_data_dir = load_and_preprocess_bulk_data(zip_filepath, extract_to_dir=os.path.join(PROJECT_ROOT, 'temp_retrain_data'))
-            print(f"Data extracted to: {extracted_data_dir}")
-            print(f"Contents of extracted data dir: {os.listdir(extracted_data_dir)}")
-
-            train_generator, class_indices = create_data_generator(extracted_data_dir, is_training=True)
-            print(f"Train generator found {train_generator.samples} samples belonging to {train_generator.num_classes} classes.")
-
-            if train_generator.samples == 0:
-                raise ValueError("The PyDataset has length 0. No images found in the provided zip data.")
-
-            num_classes = len(class_indices)
-            model = create_cnn_model(num_classes=num_classes)
-
-            train_model(model, train_generator, epochs=10, model_save_path=MODEL_PATH)
-
-            from src.prediction import _model, _class_names
-            _model = None
-            _class_names = None
-
-            return jsonify({"message": "Model retraining triggered and completed successfully!", "new_classes": list(class_indices.keys())})
-        except Exception as e:
-            print(f"Retraining error: {str(e)}")
-            return jsonify({"error": f"Retraining failed: {str(e)}"}), 500
-        finally:
-            os.remove(zip_filepath)
-            if extracted_data_dir and os.path.exists(extracted_data_dir):
-                shutil.rmtree(extracted_data_dir)
+        logger.info("Received zip file: %s (job %s)", zip_filepath, job_id)
+        status = retrain_jobs.submit(job_id, zip_filepath, mode=mode)
+        return jsonify(dict(status, message="Model retraining job queued.", status_url=f"/retrain/{job_id}")), 202
 
     return jsonify({"error": "Zip file type not allowed"}), 400
 
+@app.route('/evaluate', methods=['POST'])
+def evaluate():
+    """
+    Evaluates a model on data/test and returns accuracy, per-class precision/recall, the confusion
+    matrix and calibration stats. Evaluates the serving model unless a registry `version` is given
+    (as a form field or JSON). Only images not yet scored by that model version are run through it.
+    """
+    payload = request.get_json(silent=True) or request.form
+    version = payload.get('version')
+    try:
+        if version is None or version == get_model_stats().get("version"):
+            serving = get_serving_model()
+        elif version in model_registry.list_versions():
+            serving = load_model_version(version, warm_up=False)
+        else:
+            return jsonify({"error": f"Unknown model version: {version}"}), 404
+        report = evaluate_serving_model(serving, data_dir=TEST_DATA_DIR, batch_size=EVALUATION_BATCH_SIZE)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        logger.exception("Evaluation error: %s", e)
+        return jsonify({"error": f"Evaluation failed: {str(e)}"}), 500
+    return jsonify(report)
+
+@app.route('/models', methods=['GET'])
+def list_model_versions():
+    """Lists the registry's model versions and the one currently serving."""
+    return jsonify({
+        "current": model_registry.current_version(),
+        "serving": get_model_stats().get("version"),
+        "versions": [dict(model_registry.get_metadata(version) or {}, version=version)
+                     for version in model_registry.list_versions()],
+    })
+
+@app.route('/models/<version>/activate', methods=['POST'])
+def activate_model(version):
+    """Switches serving to an existing registry version (e.g. to roll back)."""
+    if version not in model_registry.list_versions():
+        return jsonify({"error": f"Unknown model version: {version}"}), 404
+    try:
+        activate_model_version(version)
+    except Exception as e:
+        logger.exception("Model activation error: %s", e)
+        return jsonify({"error": f"Activating model {version} failed: {str(e)}"}), 500
+    prediction_cache.clear()
+    mark_worker_ready(get_model_stats())
+    return jsonify({"message": f"Model {version} is now serving.", "version": version})
+
+@app.route('/retrain', methods=['GET'])
+def list_retrain_jobs():
+    return jsonify({"jobs": retrain_jobs.list_jobs()})
+
+@app.route('/retrain/<job_id>', methods=['GET'])
+def retrain_status(job_id):
+    """Reports a retraining job's phase, epoch, loss/accuracy and ETA."""
+    status = retrain_jobs.get(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown retraining job: {job_id}"}), 404
+    return jsonify(status)
+
 # Endpoint to serve static image files from the data directory
 @app.route('/data-images/<path:filename>')
 def serve_data_image(filename):
-    """Serves image files from the DATA_DIR."""
-    # Ensure the path is safe and within the DATA_DIR
-    return send_from_directory(DATA_DIR, filename)
+    """
+    Serves image files from the DATA_DIR. With `?size=N` it serves a JPEG thumbnail fitting in
+    N x N pixels instead (N is rounded up to one of THUMBNAIL_SIZES).
+    """
+    size = request.args.get('size', type=int)
+    if size is None:
+        # Ensure the path is safe and within the DATA_DIR
+        return send_from_directory(DATA_DIR, filename, max_age=DATA_IMAGE_MAX_AGE)
+    if size <= 0:
+        return jsonify({"error": "size must be a positive integer"}), 400
+
+    source_path = safe_join(DATA_DIR, filename)
+    if source_path is None or not os.path.isfile(source_path):
+        return jsonify({"error": f"Image not found: {filename}"}), 404
+    size = thumbnail_cache.snap_size(size)
+    try:
+        thumbnail_path, etag, stat = thumbnail_cache.get(filename, source_path, size)
+    except Exception as e:
+        logger.warning("Thumbnail generation failed for %s: %s", filename, e)
+        return send_from_directory(DATA_DIR, filename, max_age=DATA_IMAGE_MAX_AGE)
+    # The ETag and Last-Modified come from the source image, so every worker answers
+    # If-None-Match / If-Modified-Since for the same image identically
+    return send_file(thumbnail_path, mimetype='image/jpeg', conditional=True, etag=etag,
+                     last_modified=stat.st_mtime, max_age=DATA_IMAGE_MAX_AGE)
 
 # Endpoint to provide data insights
 @app.route('/data-insights', methods=['GET'])
 def get_data_insights():
-    insights = {
-        "class_distribution": {},
-        "sample_images": {},
-        "image_dimensions": {
-            "min_width": 0, "max_width": 0, "avg_width": 0,
-            "min_height": 0, "max_height": 0, "avg_height": 0,
-            "total_images": 0
-        }
-    }
-
-    all_image_paths = []
     train_dir = os.path.join(DATA_DIR, 'train')
-    print(f"DEBUG: Resolved train_dir for insights: {train_dir}")
-
     if not os.path.exists(train_dir):
         return jsonify({"error": "Training data directory not found for insights."}), 404
 
-    # Get class distribution and collect all image paths
-    for class_name in os.listdir(train_dir):
-        class_path = os.path.join(train_dir, class_name)
-        if os.path.isdir(class_path):
-            print(f"DEBUG: Checking class path: {class_path}")
-            images_in_class = [f for f in os.listdir(class_path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            print(f"DEBUG: Found {len(images_in_class)} image files in {class_name}: {images_in_class[:5]}...") # Print first 5
-            insights["class_distribution"][class_name] = len(images_in_class)
-            
-            # Collect sample images (up to 3 per class)
-            insights["sample_images"][class_name] = []
-            for i, img_name in enumerate(images_in_class):
-                if i < 3: # Limit to 3 sample images per class
-                    # Return path relative to DATA_DIR for serving
-                    relative_path = os.path.join('train', class_name, img_name)
-                    insights["sample_images"][class_name].append(relative_path)
-                all_image_paths.append(os.path.join(class_path, img_name))
-
-    # Calculate image dimensions
-    widths = []
-    heights = []
-    for img_path in all_image_paths:
-        try:
-            with Image.open(img_path) as img:
-                width, height = img.size
-                widths.append(width)
-                heights.append(height)
-        except Exception as e:
-            print(f"ERROR: Could not read image {img_path} for dimensions: {e}")
+    # Answered from the persistent per-file index; only new or modified images are re-read
+    return jsonify(train_data_index.get_insights(path_prefix='train'))
+
 
-    if widths and heights:
-        insights["image_dimensions"]["min_width"] = min(widths)
-        insights["image_dimensions"]["max_width"] = max(widths)
-        insights["image_dimensions"]["avg_width"] = float(np.mean(widths))
-        insights["image_dimensions"]["min_height"] = min(heights)
-        insights["image_dimensions"]["max_height"] = max(heights)
-        insights["image_dimensions"]["avg_height"] = float(np.mean(heights))
-        insights["image_dimensions"]["total_images"] = len(all_image_paths)
+def warm_up_serving_model():
+    """Eagerly loads and warms up the serving model, logging the cold-start time."""
+    try:
+        stats = warm_up_model()
+        logger.info("Model warmed up: cold start took %.2fs", stats.get('cold_start_seconds', 0.0))
+        mark_worker_ready(stats)
+    except FileNotFoundError as e:
+        logger.warning("Skipping model warm-up: %s", e)
 
-    return jsonify(insights)
+if EAGER_MODEL_WARMUP and __name__ != '__main__':
+    warm_up_serving_model()
+
+def _follow_current_version(version):
+    activate_model_version(version, set_current=False)
+    prediction_cache.clear()
+    mark_worker_ready(get_model_stats())
+
+if is_multi_worker() and __name__ != '__main__':
+    start_model_sync(model_registry.current_version, lambda: get_model_stats().get("version"),
+                     _follow_current_version, MODEL_SYNC_SECONDS)
+    start_metrics_snapshots(lambda: REGISTRY.collect(WORKER_METRIC_LABELS), METRICS_SNAPSHOT_SECONDS)
 
 
 if __name__ == '__main__':
     # Ensure a model exists for the API to load initially
-    if not os.path.exists(MODEL_PATH):
-        print(f"No model found at {MODEL_PATH}. Please run the Jupyter notebook to train and save a model first.")
-        print("Creating a dummy model for initial API startup. This model will not be trained.")
+    if model_registry.current_version() is None and not os.path.exists(MODEL_PATH):
+        logger.warning("No model found at %s. Please run the Jupyter notebook to train and save a model first.", MODEL_PATH)
+        logger.warning("Creating a dummy model for initial API startup. This model will not be trained.")
         dummy_model = create_cnn_model()
         # Ensure the directory for the model exists before saving
         os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
         dummy_model.save(MODEL_PATH)
-        print("Dummy model created.")
+        save_model_manifest(MODEL_PATH, {'cats': 0, 'dogs': 1}, dummy_model.input_shape[1:])
+        logger.info("Dummy model created.")
+
+    if EAGER_MODEL_WARMUP:
+        warm_up_serving_model()
 
     app.run(debug=True, port=5000)
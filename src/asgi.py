@@ -0,0 +1,247 @@
+# ASGI entry point: uvicorn src.asgi:application
+# (or under gunicorn: SERVE_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py src.asgi:application)
+#
+# Request bodies are received on the event loop and only handed to a Flask thread once complete,
+# so slow uploads no longer tie up a worker thread. Admission control runs from the headers alone,
+# before any body is read: oversized uploads, requests arriving while the inference queue is
+# saturated or the bridge's backlog is full, and requests over an endpoint's concurrency limit
+# are refused here, and the Flask app skips its own checks for them (see admit_request).
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+from src.admission import ADMITTED_ENVIRON_KEY
+from src.serving import REQUEST_CAPACITY_ENV
+
+# Threads running Flask handlers; concurrent /predict handlers are what the batching engine groups
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 64))
+# Admitted requests allowed to wait for one of those threads; beyond that new requests get 503
+ASGI_MAX_BACKLOG = int(os.environ.get('ASGI_MAX_BACKLOG', ASGI_WSGI_THREADS))
+# Set before src.api is imported, which sizes its admission limits from it
+os.environ[REQUEST_CAPACITY_ENV] = str(ASGI_WSGI_THREADS + ASGI_MAX_BACKLOG)
+
+from src.api import app, endpoint_limiters, inference_engine, INFERENCE_QUEUE_LIMIT, MAX_UPLOAD_BYTES, REQUESTS_REJECTED
+
+SPOOL_MAX_BYTES = 1024 * 1024 # Request bodies above this are buffered in a temporary file
+# Set in the scope by AdmissionMiddleware to the endpoint's upload cap, which WsgiBridge enforces while receiving
+MAX_BODY_BYTES_SCOPE_KEY = 'ml_api.max_body_bytes'
+_END = object()
+
+
+def _wsgi_environ(scope, body, content_length):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(content_length),
+        ADMITTED_ENVIRON_KEY: scope.get(ADMITTED_ENVIRON_KEY, False),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WsgiBridge:
+    """
+    Serves a WSGI app over ASGI. The body is read asynchronously, then each request runs (and
+    its response is iterated, including streamed responses) on one thread of a bounded pool.
+    `backlog()` counts requests waiting for a thread; AdmissionMiddleware keeps it under `max_backlog`.
+    Bodies larger than the endpoint's upload cap (or `max_body_bytes` for other endpoints) get 413.
+    """
+
+    def __init__(self, wsgi_app, max_threads=ASGI_WSGI_THREADS, max_body_bytes=None, max_backlog=ASGI_MAX_BACKLOG):
+        self.wsgi_app = wsgi_app
+        self.max_body_bytes = max_body_bytes
+        self.max_backlog = max_backlog
+        self.pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='wsgi')
+        self._backlog = 0
+        self._backlog_lock = threading.Lock()
+
+    def backlog(self):
+        return self._backlog
+
+    def _add_backlog(self, delta):
+        with self._backlog_lock:
+            self._backlog += delta
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        max_body_bytes = scope.get(MAX_BODY_BYTES_SCOPE_KEY, self.max_body_bytes)
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        content_length = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            chunk = message.get('body', b'')
+            body.write(chunk)
+            content_length += len(chunk)
+            if max_body_bytes is not None and content_length > max_body_bytes:
+                # Bodies sent without a Content-Length are only caught here, while they arrive
+                body.close()
+                await send({'type': 'http.response.start', 'status': 413,
+                            'headers': [(b'content-type', b'application/json'), (b'connection', b'close')]})
+                await send({'type': 'http.response.body', 'body': json.dumps({"error": "Upload too large"}).encode()})
+                return
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        response = {}
+
+        def put(item):
+            loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+        def run():
+            # The whole request, including iterating a streamed response, stays on this one thread,
+            # since Flask's request context is bound to the thread that pushed it
+            self._add_backlog(-1)
+            try:
+                result = self.wsgi_app(_wsgi_environ(scope, body, content_length), start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            put(chunk)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except BaseException as e:
+                put(e)
+            finally:
+                body.close()
+                put(_END)
+
+        self._add_backlog(1)
+        self.pool.submit(run)
+        started = False
+        while True:
+            item = await chunks.get()
+            if isinstance(item, BaseException):
+                if started:
+                    # Raising makes the server drop the connection, so a stream cut off by an error
+                    # is never terminated like a complete response
+                    raise item
+                await send({'type': 'http.response.start', 'status': 500, 'headers': []})
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            if not started:
+                await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                started = True
+            if item is _END:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                return
+            await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+
+
+class AdmissionMiddleware:
+    """
+    Wraps a WsgiBridge and admits requests from their headers, before their bodies are received.
+    A request to a limited endpoint holds its endpoint_limiters slot until its response is sent.
+    """
+
+    def __init__(self, bridge, flask_app, limiters=None):
+        self.inner = bridge
+        self.url_adapter = flask_app.url_map.bind('localhost')
+        self.limiters = endpoint_limiters if limiters is None else limiters
+        # Waiting in an admission queue blocks a thread, so it happens off the event loop
+        self.admission_pool = ThreadPoolExecutor(max_workers=max(1, sum(limiter.max_queued for limiter in self.limiters.values())),
+                                                 thread_name_prefix='admission')
+
+    def _endpoint(self, scope):
+        try:
+            endpoint, _ = self.url_adapter.match(scope['path'], method=scope['method'])
+            return endpoint
+        except HTTPException:
+            return None
+
+    async def _reject(self, send, endpoint, reason, status, message, retry_after=None):
+        REQUESTS_REJECTED.labels(endpoint=endpoint, reason=reason).inc()
+        body = json.dumps({"error": message}).encode()
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                   (b'connection', b'close')]
+        if retry_after is not None:
+            headers.append((b'retry-after', str(retry_after).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _acquire(self, limiter):
+        if not limiter.max_queued:
+            return limiter.acquire() # Never waits without an admission queue
+        return await asyncio.get_running_loop().run_in_executor(self.admission_pool, limiter.acquire)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.inner(scope, receive, send)
+        endpoint = self._endpoint(scope)
+        if self.inner.backlog() >= self.inner.max_backlog:
+            return await self._reject(send, endpoint or 'unmatched', 'overloaded', 503,
+                                      "The server is overloaded; retry later.", 1)
+        limiter = self.limiters.get(endpoint) if scope['method'] == 'POST' else None
+        if limiter is None:
+            return await self.inner(scope, receive, send)
+
+        max_bytes = MAX_UPLOAD_BYTES.get(endpoint)
+        content_length = dict(scope['headers']).get(b'content-length')
+        if max_bytes is not None and content_length is not None and int(content_length) > max_bytes:
+            return await self._reject(send, endpoint, 'too_large', 413,
+                                      f"Upload too large: {int(content_length)} bytes (limit is {max_bytes})")
+        # Requests waiting for a bridge thread are queued inference work too
+        if endpoint == 'predict' and inference_engine.queue_depth() + self.inner.backlog() >= INFERENCE_QUEUE_LIMIT:
+            retry_after = max(1, int(inference_engine.estimated_wait_seconds() + 0.999))
+            return await self._reject(send, endpoint, 'saturated', 503,
+                                      "The inference queue is full; retry later.", retry_after)
+        if not await self._acquire(limiter):
+            return await self._reject(send, endpoint, 'busy', 429, "Too many concurrent requests; retry later.",
+                                      limiter.retry_after_seconds())
+        try:
+            admitted_scope = dict(scope, **{ADMITTED_ENVIRON_KEY: True})
+            if max_bytes is not None:
+                admitted_scope[MAX_BODY_BYTES_SCOPE_KEY] = max_bytes
+            await self.inner(admitted_scope, receive, send)
+        finally:
+            limiter.release()
+
+
+application = AdmissionMiddleware(WsgiBridge(app, max_body_bytes=app.config['MAX_CONTENT_LENGTH']), app)
@@ -0,0 +1,184 @@
+import threading
+import queue
+import time
+from collections import deque
+
+import numpy as np
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+LATENCY_WINDOW = 1000 # Number of recent request latencies kept for percentile stats
+BATCH_TIME_SMOOTHING = 0.2 # Weight of the newest batch in the moving average of batch durations
+
+
+class _PendingRequest:
+    """
+    A single caller waiting for its slice of a batched forward pass.
+    """
+    __slots__ = ('image_array', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, image_array):
+        self.image_array = image_array
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingEngine:
+    """
+    Groups concurrent prediction requests into micro-batches.
+
+    Callers block in `submit` while a single worker thread drains the queue,
+    stacking up to `max_batch_size` images (or whatever arrived within
+    `max_wait_ms` of the first one) into one array and running `predict_fn`
+    on it once. `predict_fn` must accept an array of shape (N, H, W, C) and
+    return a list of N per-image results.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, max_queue_size=0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+
+        self._stats_lock = threading.Lock()
+        self._batch_size_histogram = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._requests_total = 0
+        self._batches_total = 0
+        self._errors_total = 0
+        self._avg_batch_seconds = None
+
+    def start(self):
+        """Starts the worker thread if it is not already running."""
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopping = False
+                self._worker = threading.Thread(target=self._run, name='batching-engine', daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout=None):
+        """Stops the worker thread after the batch in progress completes."""
+        self._stopping = True
+        if self._worker is not None:
+            self._queue.put(None) # Wake the worker up if it is idle
+            self._worker.join(timeout)
+            self._worker = None
+
+    def submit(self, image_array, timeout=None):
+        """
+        Queues a preprocessed image (batch dimension of 1) and blocks until its result is ready.
+        Re-raises any exception raised by `predict_fn` for the batch it was part of.
+        """
+        if self._worker is None:
+            self.start()
+        request = _PendingRequest(image_array)
+        self._queue.put(request, timeout=timeout)
+        if not request.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for a batched prediction result.")
+
+        latency = time.perf_counter() - request.enqueued_at
+        with self._stats_lock:
+            self._latencies.append(latency)
+            self._requests_total += 1
+            if request.error is not None:
+                self._errors_total += 1
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def estimated_wait_seconds(self):
+        """
+        Estimates how long a request submitted now would wait for its result: the queued
+        requests divided into full batches, times the moving average batch duration.
+        """
+        avg_batch_seconds = self._avg_batch_seconds or 0.0
+        return (self.queue_depth() // self.max_batch_size + 1) * avg_batch_seconds
+
+    def stats(self):
+        """Returns queue depth, the batch-size histogram and per-request latency percentiles."""
+        with self._stats_lock:
+            latencies = np.array(self._latencies, dtype=np.float64)
+            histogram = dict(sorted(self._batch_size_histogram.items()))
+            requests_total = self._requests_total
+            batches_total = self._batches_total
+            errors_total = self._errors_total
+
+        latency_ms = {"count": int(latencies.size)}
+        if latencies.size:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000.0
+            latency_ms.update({
+                "mean": float(latencies.mean() * 1000.0),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(latencies.max() * 1000.0),
+            })
+
+        return {
+            "queue_depth": self.queue_depth(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "requests_total": requests_total,
+            "batches_total": batches_total,
+            "errors_total": errors_total,
+            "avg_batch_size": (requests_total / batches_total) if batches_total else 0.0,
+            "avg_batch_ms": (self._avg_batch_seconds or 0.0) * 1000.0,
+            "estimated_wait_ms": self.estimated_wait_seconds() * 1000.0,
+            "batch_size_histogram": {str(size): count for size, count in histogram.items()},
+            "latency_ms": latency_ms,
+        }
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Drain whatever is already queued even once the wait window has passed
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopping = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopping:
+            first = self._queue.get()
+            if first is None:
+                continue
+            batch = self._collect_batch(first)
+            batch_start = time.perf_counter()
+            try:
+                stacked = np.concatenate([request.image_array for request in batch], axis=0)
+                results = self.predict_fn(stacked)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"predict_fn returned {len(results)} results for a batch of {len(batch)}.")
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                with self._stats_lock:
+                    elapsed = time.perf_counter() - batch_start
+                    self._avg_batch_seconds = elapsed if self._avg_batch_seconds is None else \
+                        (1 - BATCH_TIME_SMOOTHING) * self._avg_batch_seconds + BATCH_TIME_SMOOTHING * elapsed
+                    self._batches_total += 1
+                    self._batch_size_histogram[len(batch)] = self._batch_size_histogram.get(len(batch), 0) + 1
+                for request in batch:
+                    request.done.set()
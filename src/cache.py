@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionCache:
+    """
+    Caches prediction results keyed by a hash of the uploaded bytes plus the model version.
+
+    The in-memory tier is an LRU bounded by `max_entries` and `max_bytes`, with an optional
+    per-entry TTL. When `disk_dir` is set, entries are also written there as small JSON files
+    and memory misses fall back to them, so results survive restarts and memory eviction.
+    Because the model version is part of every key, a new model never sees old results;
+    `clear()` additionally drops everything once the old model is retired.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl_seconds=None,
+                 disk_dir=None, disk_max_entries=100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict() # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(data, model_version):
+        return f"{hashlib.sha256(data).hexdigest()}:{model_version}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    @staticmethod
+    def _is_entry_file(name):
+        """True for the <sha1>.json files this cache writes, so other files in `disk_dir` are never touched."""
+        stem, extension = os.path.splitext(name)
+        return extension == '.json' and len(stem) == 40 and all(c in '0123456789abcdef' for c in stem)
+
+    def _disk_entries(self):
+        try:
+            return [entry for entry in os.scandir(self.disk_dir) if self._is_entry_file(entry.name)]
+        except OSError:
+            return []
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None on a miss."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                if expires_at is not None and expires_at <= now:
+                    self._remove(key)
+                    self._counters["expirations"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+        self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Stores a JSON-serializable value under `key`."""
+        if not self.enabled:
+            return
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def clear(self):
+        """Drops every cached entry, including the on-disk tier."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir:
+            for entry in self._disk_entries():
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), bytes=self._bytes,
+                         max_entries=self.max_entries, max_bytes=self.max_bytes,
+                         ttl_seconds=self.ttl_seconds, disk_dir=self.disk_dir)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _memory_put(self, key, value):
+        size = len(json.dumps(value)) + len(key)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters["evictions"] += 1
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record["value"] if record.get("key") == key else None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"key": key, "value": value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache entry to disk: %s", e)
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 256 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Deletes the least recently written disk entries above `disk_max_entries`."""
+        entries = self._disk_entries()
+        excess = len(entries) - self.disk_max_entries
+        if excess <= 0:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:excess]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
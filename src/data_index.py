@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# The image extensions used everywhere in the project: the ones flow_from_directory accepts.
+# Defined here because this module only needs Pillow, so setup_data.py can use it without TensorFlow.
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+INDEX_FORMAT_VERSION = 1
+SAMPLES_PER_CLASS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def read_image_dimensions(path):
+    """
+    Returns (width, height) of an image, or (None, None) if it cannot be read.
+    Image.open only parses the header, so the pixel data is never decoded.
+    """
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception as e:
+        logger.error("Could not read image %s for dimensions: %s", path, e)
+        return None, None
+
+
+class DatasetIndex:
+    """
+    Persistent per-file index of an image dataset laid out as <data_dir>/<class>/<image>.
+
+    Each record holds the file's class, size, mtime, width and height. `refresh()` stats
+    every file but only reads the headers of files that are new or whose size/mtime changed,
+    in parallel, and then recomputes the aggregates that `get_insights()` serves. The index is
+    saved to `index_path` so a restart does not need to re-read any image headers.
+    """
+
+    def __init__(self, data_dir, index_path, min_refresh_interval=30.0, max_workers=None):
+        self.data_dir = data_dir
+        self.index_path = index_path
+        self.min_refresh_interval = min_refresh_interval
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self._records = {} # relative path -> [class_name, size, mtime_ns, width, height]
+        self._class_names = set() # Class directories seen by the last scan, including empty ones
+        self._aggregates = None
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable index %s: %s", self.index_path, e)
+            return
+        if saved.get("version") == INDEX_FORMAT_VERSION and saved.get("data_dir") == os.path.abspath(self.data_dir):
+            self._records = saved.get("files", {})
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        # Every gunicorn worker may save at the same time, so each one writes its own temporary file
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": INDEX_FORMAT_VERSION, "data_dir": os.path.abspath(self.data_dir),
+                       "files": self._records}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+
+    def _scan(self):
+        """
+        Returns ({relative path: (class_name, size, mtime_ns)}, class_names) for every image currently on disk.
+        """
+        found = {}
+        class_names = set()
+        with os.scandir(self.data_dir) as class_entries:
+            for class_entry in class_entries:
+                if not class_entry.is_dir():
+                    continue
+                class_names.add(class_entry.name)
+                with os.scandir(class_entry.path) as image_entries:
+                    for image_entry in image_entries:
+                        if image_entry.name.lower().endswith(IMAGE_EXTENSIONS) and image_entry.is_file():
+                            stat = image_entry.stat()
+                            relative_path = f"{class_entry.name}/{image_entry.name}"
+                            found[relative_path] = (class_entry.name, stat.st_size, stat.st_mtime_ns)
+        return found, class_names
+
+    def refresh(self, force=False):
+        """
+        Brings the index up to date with the files on disk.
+        Calls within `min_refresh_interval` seconds of the previous refresh are no-ops unless `force` is set.
+        Returns the number of added, changed or removed records.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.min_refresh_interval:
+                return 0
+
+            found, class_names = self._scan()
+            stale = []
+            for path, (class_name, size, mtime_ns) in found.items():
+                record = self._records.get(path)
+                if record is None or record[0] != class_name or record[1] != size or record[2] != mtime_ns:
+                    stale.append(path)
+            removed = [path for path in self._records if path not in found]
+
+            if stale:
+                full_paths = [os.path.join(self.data_dir, *path.split('/')) for path in stale]
+                with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                    dimensions = list(pool.map(read_image_dimensions, full_paths))
+                for path, (width, height) in zip(stale, dimensions):
+                    class_name, size, mtime_ns = found[path]
+                    self._records[path] = [class_name, size, mtime_ns, width, height]
+            for path in removed:
+                del self._records[path]
+
+            changes = len(stale) + len(removed)
+            if changes:
+                logger.info("Dataset index for %s: %d files indexed, %d removed", self.data_dir, len(stale), len(removed))
+                self._save()
+            if changes or class_names != self._class_names or self._aggregates is None:
+                self._class_names = class_names
+                self._aggregates = self._compute_aggregates()
+            self._last_refresh = time.monotonic()
+            return changes
+
+    def _compute_aggregates(self):
+        class_counts = {class_name: 0 for class_name in self._class_names}
+        class_files = {class_name: [] for class_name in self._class_names}
+        widths = []
+        heights = []
+        for path, (class_name, _, _, width, height) in self._records.items():
+            class_counts[class_name] += 1
+            class_files[class_name].append(path)
+            if width is not None and height is not None:
+                widths.append(width)
+                heights.append(height)
+
+        dimensions = {
+            "min_width": 0, "max_width": 0, "avg_width": 0,
+            "min_height": 0, "max_height": 0, "avg_height": 0,
+            "total_images": 0
+        }
+        if widths and heights:
+            dimensions.update({
+                "min_width": min(widths), "max_width": max(widths), "avg_width": sum(widths) / len(widths),
+                "min_height": min(heights), "max_height": max(heights), "avg_height": sum(heights) / len(heights),
+                "total_images": len(self._records),
+            })
+        return {
+            "class_distribution": dict(sorted(class_counts.items())),
+            "samples": {class_name: sorted(paths)[:SAMPLES_PER_CLASS] for class_name, paths in sorted(class_files.items())},
+            "image_dimensions": dimensions,
+        }
+
+    def get_insights(self, path_prefix=''):
+        """
+        Returns class distribution, sample image paths and image dimension stats from the index,
+        refreshing it first if `min_refresh_interval` has passed. Sample paths are prefixed with `path_prefix`.
+        """
+        self.refresh()
+        aggregates = self._aggregates
+        return {
+            "class_distribution": dict(aggregates["class_distribution"]),
+            "sample_images": {
+                class_name: [os.path.join(path_prefix, *path.split('/')) for path in paths]
+                for class_name, paths in aggregates["samples"].items()
+            },
+            "image_dimensions": dict(aggregates["image_dimensions"]),
+        }
@@ -0,0 +1,190 @@
+import logging
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from src.data_index import IMAGE_EXTENSIONS
+from src.preprocessing import IMG_HEIGHT, IMG_WIDTH
+
+AUTOTUNE = tf.data.AUTOTUNE
+# The IMAGE_EXTENSIONS tf.io.decode_image can read; .ppm and .tif/.tiff need PIL (flow_from_directory)
+TF_DECODABLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Augmentation settings of the training ImageDataGenerator in create_data_generator
+ROTATION_RANGE = 20 # degrees
+WIDTH_SHIFT_RANGE = 0.2 # fraction of width
+HEIGHT_SHIFT_RANGE = 0.2 # fraction of height
+SHEAR_RANGE = 0.2 # degrees, as in ImageDataGenerator
+ZOOM_RANGE = 0.2
+HORIZONTAL_FLIP = True
+SHUFFLE_BUFFER_SIZE = 1000 # Decoded images held for shuffling when decoding is cached
+
+logger = logging.getLogger(__name__)
+
+
+def list_image_files(data_dir):
+    """
+    Returns (paths, labels, class_indices) for a <data_dir>/<class>/<image> tree.
+    Classes are the sorted subdirectory names, exactly as flow_from_directory assigns them.
+    """
+    if not os.path.exists(data_dir):
+        raise FileNotFoundError(f"Data directory not found: {data_dir}")
+    class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    class_indices = {name: index for index, name in enumerate(class_names)}
+    paths = []
+    labels = []
+    for class_name in class_names:
+        class_dir = os.path.join(data_dir, class_name)
+        for root, _, files in os.walk(class_dir):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+                    labels.append(class_indices[class_name])
+    return paths, labels, class_indices
+
+def tf_decodable_files(files):
+    """
+    Drops the images tf.io.decode_image cannot read from a (paths, labels, class_indices)
+    triple returned by list_image_files, logging how many were left out.
+    """
+    paths, labels, class_indices = files
+    kept = [(path, label) for path, label in zip(paths, labels) if path.lower().endswith(TF_DECODABLE_EXTENSIONS)]
+    if len(kept) < len(paths):
+        logger.warning("Skipping %d images in formats the tf.data pipeline cannot decode (%s only)",
+                       len(paths) - len(kept), ', '.join(TF_DECODABLE_EXTENSIONS))
+    return [path for path, _ in kept], [label for _, label in kept], class_indices
+
+def decode_and_resize(image_bytes):
+    """Decodes image bytes to an RGB uint8 tensor resized to IMG_HEIGHT x IMG_WIDTH (nearest, like load_img)."""
+    image = tf.io.decode_image(image_bytes, channels=3, expand_animations=False)
+    image = tf.image.resize(image, (IMG_HEIGHT, IMG_WIDTH), method='nearest')
+    image.set_shape((IMG_HEIGHT, IMG_WIDTH, 3))
+    return tf.cast(image, tf.uint8)
+
+def _load_image(path, label):
+    return decode_and_resize(tf.io.read_file(path)), label
+
+def _affine_matrices(batch_size, height, width):
+    """
+    Samples one random transform per image, composed the way ImageDataGenerator.random_transform
+    does (rotation, shift, shear, zoom about the image centre, in row/column coordinates), and
+    returns them as the flattened output->input projective transforms tf.raw_ops expects.
+    """
+    def uniform(low, high):
+        return tf.random.uniform((batch_size,), low, high)
+
+    zeros = tf.zeros((batch_size,))
+    ones = tf.ones((batch_size,))
+
+    def matrix(rows):
+        return tf.stack([tf.stack(row, axis=-1) for row in rows], axis=-2)
+
+    theta = uniform(-ROTATION_RANGE, ROTATION_RANGE) * (math.pi / 180.0)
+    tx = uniform(-HEIGHT_SHIFT_RANGE, HEIGHT_SHIFT_RANGE) * height # Row shift
+    ty = uniform(-WIDTH_SHIFT_RANGE, WIDTH_SHIFT_RANGE) * width # Column shift
+    shear = uniform(-SHEAR_RANGE, SHEAR_RANGE) * (math.pi / 180.0)
+    zx = uniform(1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    zy = uniform(1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+
+    rotation = matrix([[tf.cos(theta), -tf.sin(theta), zeros], [tf.sin(theta), tf.cos(theta), zeros], [zeros, zeros, ones]])
+    shift = matrix([[ones, zeros, tx], [zeros, ones, ty], [zeros, zeros, ones]])
+    shear_matrix = matrix([[ones, -tf.sin(shear), zeros], [zeros, tf.cos(shear), zeros], [zeros, zeros, ones]])
+    zoom = matrix([[zx, zeros, zeros], [zeros, zy, zeros], [zeros, zeros, ones]])
+    transform = rotation @ shift @ shear_matrix @ zoom
+
+    o_row = height / 2.0 - 0.5
+    o_col = width / 2.0 - 0.5
+    offset = tf.constant([[1, 0, o_row], [0, 1, o_col], [0, 0, 1]], dtype=tf.float32)
+    reset = tf.constant([[1, 0, -o_row], [0, 1, -o_col], [0, 0, 1]], dtype=tf.float32)
+    transform = offset @ transform @ reset
+
+    # Swap (row, col) to the (x, y) = (col, row) convention of ImageProjectiveTransformV3
+    swap = tf.constant([[0, 1, 0], [1, 0, 0], [0, 0, 1]], dtype=tf.float32)
+    transform = swap @ transform @ swap
+    return tf.reshape(transform, (batch_size, 9))[:, :8]
+
+def augment_batch(images):
+    """
+    Applies random rotation/shift/shear/zoom (bilinear, nearest fill) and horizontal flips to a
+    whole batch of float32 images in one vectorized op, matching the training ImageDataGenerator.
+    """
+    shape = tf.shape(images)
+    batch_size, height, width = shape[0], shape[1], shape[2]
+    transforms = _affine_matrices(batch_size, tf.cast(height, tf.float32), tf.cast(width, tf.float32))
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=tf.stack([height, width]),
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST')
+    if HORIZONTAL_FLIP:
+        flip = tf.random.uniform((batch_size, 1, 1, 1)) < 0.5
+        images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    return images
+
+def batch_and_prefetch(dataset, batch_size, is_training):
+    """
+    Batches a dataset of (uint8 image, label) pairs, applies augmentation (training only)
+    and rescaling to [0, 1] per batch, and prefetches.
+    """
+    dataset = dataset.batch(batch_size)
+    if is_training:
+        dataset = dataset.map(lambda images, y: (augment_batch(tf.cast(images, tf.float32)) / 255.0, y),
+                              num_parallel_calls=AUTOTUNE)
+    else:
+        dataset = dataset.map(lambda images, y: (tf.cast(images, tf.float32) / 255.0, y),
+                              num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+def create_tf_dataset(data_dir, batch_size=32, shuffle=True, is_training=True, cache=None, files=None):
+    """
+    Builds a tf.data input pipeline equivalent to create_data_generator: parallel decode and
+    resize, optional caching of the decoded uint8 images, batched vectorized augmentation
+    (training only), rescaling to [0, 1] and prefetching.
+
+    `cache` is None (decode every epoch), 'memory', or a file path prefix for an on-disk cache.
+    `files` may pass a precomputed (paths, labels, class_indices) from list_image_files.
+    Images in formats TF cannot decode are left out (see tf_decodable_files), and images that
+    fail to decode are skipped with a warning. Labels are sparse class indices, which the model's
+    sparse_categorical_crossentropy expects for any number of classes. Returns (dataset, class_indices).
+    """
+    paths, labels, class_indices = tf_decodable_files(files if files is not None else list_image_files(data_dir))
+    if not paths:
+        raise ValueError(f"No images found in {data_dir}")
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, np.asarray(labels, dtype=np.int32)))
+    if shuffle and cache is None:
+        dataset = dataset.shuffle(len(paths), reshuffle_each_iteration=True)
+    dataset = dataset.map(_load_image, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    dataset = dataset.ignore_errors(log_warning=True)
+    if cache is not None:
+        dataset = dataset.cache('' if cache == 'memory' else cache)
+        if shuffle:
+            dataset = dataset.shuffle(min(len(paths), SHUFFLE_BUFFER_SIZE), reshuffle_each_iteration=True)
+
+    return batch_and_prefetch(dataset, batch_size, is_training), class_indices
+
+def create_record_dataset(paths, member_indices, labels, read_member=None, batch_size=32, shuffle=True, is_training=True):
+    """
+    Builds the same batched pipeline as create_tf_dataset over a mix of image sources: sample i
+    is read from the file paths[i], or, when member_indices[i] >= 0, from `read_member(index)`
+    (e.g. ZipImageSource.read). Samples that fail to read or decode are skipped.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((list(paths), np.asarray(member_indices, dtype=np.int64),
+                                                  np.asarray(labels, dtype=np.int32)))
+    if shuffle:
+        dataset = dataset.shuffle(len(labels), reshuffle_each_iteration=True)
+
+    def read(path, member):
+        if read_member is None:
+            return tf.io.read_file(path)
+
+        def from_member():
+            data = tf.py_function(lambda index: read_member(int(index.numpy())), [member], tf.string)
+            data.set_shape(())
+            return data
+        return tf.cond(member >= 0, from_member, lambda: tf.io.read_file(path))
+
+    dataset = dataset.map(lambda path, member, label: (decode_and_resize(read(path, member)), label),
+                          num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    dataset = dataset.ignore_errors(log_warning=True)
+    return batch_and_prefetch(dataset, batch_size, is_training)
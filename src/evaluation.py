@@ -0,0 +1,350 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.data_pipeline import list_image_files
+from src.prediction import get_serving_model_path, load_serving_model, model_registry
+from src.preprocessing import IMG_HEIGHT, IMG_WIDTH, decode_image_into, normalize_image
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TEST_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'test')
+EVALUATION_CACHE_DIR = os.path.join(PROJECT_ROOT, 'cache', 'evaluation')
+EVALUATION_BATCH_SIZE = 256
+CALIBRATION_BINS = 10
+CACHE_FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def to_class_probabilities(outputs):
+    """
+    Turns raw model outputs of shape (N, K) into per-class probabilities of shape (N, max(K, 2)).
+    A single sigmoid output is expanded to the two columns [1 - p, p].
+    """
+    outputs = np.asarray(outputs, dtype=np.float64)
+    if outputs.ndim == 1:
+        outputs = outputs[:, None]
+    if outputs.shape[1] == 1:
+        return np.hstack([1.0 - outputs, outputs])
+    return outputs
+
+def _safe_divide(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator), dtype=np.float64),
+                     where=np.asarray(denominator) > 0)
+
+def compute_metrics(y_true, probabilities, class_names, num_bins=CALIBRATION_BINS):
+    """
+    Computes classification and calibration metrics from integer labels `y_true` (N,) and
+    class probabilities (N, K), without any per-sample Python loop.
+
+    Returns accuracy, per-class precision/recall/F1/support, their macro averages, the
+    confusion matrix (rows are true classes, columns predicted ones) and calibration stats:
+    expected and maximum calibration error over `num_bins` equal-width confidence bins, the
+    Brier score, the mean negative log-likelihood and the per-bin reliability table.
+    """
+    y_true = np.asarray(y_true, dtype=np.int64)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    num_classes = len(class_names)
+    if len(y_true) == 0:
+        return {"num_samples": 0, "class_names": list(class_names)}
+
+    y_pred = probabilities.argmax(axis=1)
+    confidence = probabilities[np.arange(len(y_true)), y_pred]
+    correct = y_pred == y_true
+
+    confusion = np.bincount(y_true * num_classes + y_pred, minlength=num_classes * num_classes)
+    confusion = confusion.reshape(num_classes, num_classes)
+    true_positives = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    precision = _safe_divide(true_positives, predicted)
+    recall = _safe_divide(true_positives, support)
+    f1 = _safe_divide(2 * precision * recall, precision + recall)
+
+    bins = np.minimum((confidence * num_bins).astype(np.int64), num_bins - 1)
+    bin_counts = np.bincount(bins, minlength=num_bins)
+    bin_confidence = _safe_divide(np.bincount(bins, weights=confidence, minlength=num_bins), bin_counts)
+    bin_accuracy = _safe_divide(np.bincount(bins, weights=correct.astype(np.float64), minlength=num_bins), bin_counts)
+    gaps = np.abs(bin_accuracy - bin_confidence)
+    one_hot = np.zeros_like(probabilities)
+    one_hot[np.arange(len(y_true)), y_true] = 1.0
+    true_class_probability = np.clip(probabilities[np.arange(len(y_true)), y_true], 1e-12, 1.0)
+
+    present = support > 0 # Macro averages only cover classes that occur in the data
+    return {
+        "num_samples": int(len(y_true)),
+        "accuracy": float(correct.mean()),
+        "class_names": list(class_names),
+        "per_class": {
+            name: {"precision": float(precision[i]), "recall": float(recall[i]), "f1": float(f1[i]),
+                   "support": int(support[i])}
+            for i, name in enumerate(class_names)
+        },
+        "macro_precision": float(precision[present].mean()),
+        "macro_recall": float(recall[present].mean()),
+        "macro_f1": float(f1[present].mean()),
+        "confusion_matrix": confusion.tolist(),
+        "calibration": {
+            "ece": float(np.sum(gaps * bin_counts) / len(y_true)),
+            "mce": float(gaps[bin_counts > 0].max()),
+            "brier_score": float(np.mean(np.sum((probabilities - one_hot) ** 2, axis=1))),
+            "nll": float(-np.mean(np.log(true_class_probability))),
+            "mean_confidence": float(confidence.mean()),
+            "bins": [{"lower": i / num_bins, "upper": (i + 1) / num_bins, "count": int(bin_counts[i]),
+                      "confidence": float(bin_confidence[i]), "accuracy": float(bin_accuracy[i])}
+                     for i in range(num_bins)],
+        },
+    }
+
+
+class PredictionStore:
+    """
+    Per-model-version store of the class probabilities predicted for each evaluation image,
+    saved as one JSON file per version under `cache_dir`.
+
+    Entries are keyed by the image's relative path and remember its size and mtime, so a
+    re-evaluation of the same model only scores images that are new or have changed.
+    """
+
+    def __init__(self, cache_dir, model_version, data_dir):
+        self.model_version = model_version
+        self.data_dir = os.path.abspath(data_dir)
+        key = hashlib.sha1(f"{model_version}\n{self.data_dir}".encode()).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, f"{key}.json") if cache_dir else None
+        self._entries = {} # relative path -> [size, mtime_ns, probabilities]
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable evaluation cache %s: %s", self.path, e)
+            return
+        if (saved.get("version") == CACHE_FORMAT_VERSION and saved.get("model_version") == self.model_version
+                and saved.get("data_dir") == self.data_dir):
+            self._entries = saved.get("predictions", {})
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": CACHE_FORMAT_VERSION, "model_version": self.model_version,
+                       "data_dir": self.data_dir, "predictions": self._entries}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, relative_path, size, mtime_ns):
+        entry = self._entries.get(relative_path)
+        if entry is not None and entry[0] == size and entry[1] == mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, relative_path, size, mtime_ns, probabilities):
+        self._entries[relative_path] = [size, mtime_ns, probabilities]
+
+    def prune(self, keep):
+        """Drops entries of images that are no longer part of the dataset."""
+        for relative_path in set(self._entries) - set(keep):
+            del self._entries[relative_path]
+
+
+def _decode_batch(data_dir, relative_paths, input_shape, pool):
+    """Decodes and normalizes images into one (N, H, W, C) array in parallel. Returns (array, failed indices)."""
+    batch = np.empty((len(relative_paths),) + tuple(input_shape), dtype=np.float32)
+
+    def decode(i):
+        try:
+            decode_image_into(os.path.join(data_dir, *relative_paths[i].split('/')), batch[i])
+            return None
+        except Exception as e:
+            logger.warning("Skipping unreadable evaluation image %s: %s", relative_paths[i], e)
+            return i
+
+    failed = [i for i in pool.map(decode, range(len(relative_paths))) if i is not None]
+    return normalize_image(batch), failed
+
+def score_images(model, data_dir, relative_paths, input_shape, batch_size=EVALUATION_BATCH_SIZE, workers=None):
+    """
+    Runs `model` over images in batches of `batch_size`. Each batch is decoded in parallel
+    while the previous one is being scored. Returns ({relative path: probabilities}, failed paths).
+    """
+    results, failed = {}, []
+    if not relative_paths:
+        return results, failed
+    batches = [relative_paths[start:start + batch_size] for start in range(0, len(relative_paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1), thread_name_prefix='eval-decode') as pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='eval-prefetch') as prefetch:
+        pending = prefetch.submit(_decode_batch, data_dir, batches[0], input_shape, pool)
+        for position, paths in enumerate(batches):
+            batch, batch_failed = pending.result()
+            if position + 1 < len(batches):
+                pending = prefetch.submit(_decode_batch, data_dir, batches[position + 1], input_shape, pool)
+            probabilities = to_class_probabilities(model.predict(batch, batch_size=len(batch), verbose=0))
+            failed_set = set(batch_failed)
+            for i, path in enumerate(paths):
+                if i in failed_set:
+                    failed.append(path)
+                else:
+                    results[path] = probabilities[i].tolist()
+    return results, failed
+
+def evaluate_model(model, class_names, model_version, data_dir=TEST_DATA_DIR, input_shape=None,
+                   batch_size=EVALUATION_BATCH_SIZE, workers=None, cache_dir=EVALUATION_CACHE_DIR):
+    """
+    Evaluates a model on a labeled dataset (by default data/test) and returns a report of
+    compute_metrics plus timing and cache counts.
+
+    Predictions are cached per `model_version` in `cache_dir` (None disables the cache), so
+    evaluating the same model again only scores images added or changed since. Images whose
+    class the model does not know, or that cannot be decoded, are counted but not scored.
+    """
+    if not os.path.isdir(data_dir):
+        raise FileNotFoundError(f"Evaluation data directory not found: {data_dir}")
+    start = time.perf_counter()
+    input_shape = tuple(input_shape or (IMG_HEIGHT, IMG_WIDTH, 3))
+    paths, label_indices, directory_indices = list_image_files(data_dir)
+    directory_names = sorted(directory_indices, key=directory_indices.get)
+    relative_paths = [os.path.relpath(path, data_dir).replace(os.sep, '/') for path in paths]
+    labels = [directory_names[label] for label in label_indices]
+    file_stats = {}
+    for relative_path, path in zip(relative_paths, paths):
+        stat = os.stat(path)
+        file_stats[relative_path] = (stat.st_size, stat.st_mtime_ns)
+    class_index = {name: i for i, name in enumerate(class_names)}
+    known = [i for i, label in enumerate(labels) if label in class_index]
+    unknown_classes = sorted({label for label in labels if label not in class_index})
+
+    store = PredictionStore(cache_dir, model_version, data_dir)
+    probabilities_by_path = {}
+    to_score = []
+    for i in known:
+        path = relative_paths[i]
+        cached = store.get(path, *file_stats[path])
+        if cached is not None:
+            probabilities_by_path[path] = cached
+        else:
+            to_score.append(path)
+    num_cached = len(probabilities_by_path)
+
+    scored, failed = score_images(model, data_dir, to_score, input_shape, batch_size=batch_size, workers=workers)
+    for path, probabilities in scored.items():
+        store.put(path, *file_stats[path], probabilities)
+    probabilities_by_path.update(scored)
+    if scored or len(store) != len(probabilities_by_path):
+        store.prune(probabilities_by_path)
+        store.save()
+
+    evaluated = [i for i in known if relative_paths[i] in probabilities_by_path]
+    y_true = np.fromiter((class_index[labels[i]] for i in evaluated), dtype=np.int64, count=len(evaluated))
+    if evaluated:
+        probabilities = np.asarray([probabilities_by_path[relative_paths[i]] for i in evaluated], dtype=np.float64)
+        if probabilities.shape[1] != len(class_names):
+            raise ValueError(f"Model {model_version} outputs {probabilities.shape[1]} classes "
+                             f"but has {len(class_names)} class names")
+    else:
+        # An empty test split (or one with no usable image) yields a report without accuracy,
+        # which check_promotion treats as a failed evaluation
+        probabilities = np.empty((0, len(class_names)), dtype=np.float64)
+
+    report = compute_metrics(y_true, probabilities, class_names)
+    elapsed = time.perf_counter() - start
+    report.update({
+        "model_version": model_version,
+        "data_dir": data_dir,
+        "num_images": len(relative_paths),
+        "num_scored": len(scored),
+        "num_cached": num_cached,
+        "num_failed": len(failed),
+        "num_unknown_class": len(relative_paths) - len(known),
+        "unknown_classes": unknown_classes,
+        "seconds": elapsed,
+        "scored_per_sec": len(scored) / elapsed if elapsed else 0.0,
+    })
+    logger.info("Evaluated model %s on %d images (%d scored, %d cached) in %.2fs: accuracy %.4f",
+                model_version, len(evaluated), len(scored), num_cached, elapsed, report.get("accuracy", 0.0))
+    return report
+
+def evaluate_serving_model(serving, **kwargs):
+    """Evaluates a prediction.ServingModel (see evaluate_model for the keyword arguments)."""
+    return evaluate_model(serving.model, serving.class_names, serving.version, input_shape=serving.input_shape, **kwargs)
+
+def check_promotion(candidate, baseline=None, min_accuracy=0.0, max_accuracy_drop=0.01, max_ece_increase=None):
+    """
+    Decides whether a candidate model may replace the baseline, from their evaluation reports.
+    The candidate must reach `min_accuracy`, and lose at most `max_accuracy_drop` accuracy (and,
+    if set, gain at most `max_ece_increase` calibration error) relative to the baseline, which
+    is skipped when there is no baseline or it was evaluated on different classes.
+    Returns (passed, reasons) where `reasons` lists every failed check.
+    """
+    reasons = []
+    accuracy = candidate.get("accuracy")
+    if accuracy is None:
+        return False, ["The candidate could not be evaluated on any image"]
+    if accuracy < min_accuracy:
+        reasons.append(f"accuracy {accuracy:.4f} is below the minimum of {min_accuracy:.4f}")
+    if baseline and baseline.get("accuracy") is not None and baseline.get("class_names") == candidate.get("class_names"):
+        if accuracy < baseline["accuracy"] - max_accuracy_drop:
+            reasons.append(f"accuracy {accuracy:.4f} is more than {max_accuracy_drop:.4f} below "
+                           f"the serving model's {baseline['accuracy']:.4f}")
+        if max_ece_increase is not None:
+            ece, baseline_ece = candidate["calibration"]["ece"], baseline["calibration"]["ece"]
+            if ece > baseline_ece + max_ece_increase:
+                reasons.append(f"calibration error {ece:.4f} is more than {max_ece_increase:.4f} above "
+                               f"the serving model's {baseline_ece:.4f}")
+    return not reasons, reasons
+
+def summarize(report):
+    """Returns the headline numbers of an evaluation report (without per-bin and per-image detail)."""
+    keys = ('model_version', 'num_samples', 'accuracy', 'macro_precision', 'macro_recall', 'macro_f1',
+            'num_scored', 'num_cached', 'num_failed', 'seconds')
+    summary = {key: report[key] for key in keys if key in report}
+    if "calibration" in report:
+        summary["ece"] = report["calibration"]["ece"]
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluates a model on the test split.")
+    model_group = parser.add_mutually_exclusive_group()
+    model_group.add_argument('--model', help="Model file (.h5 or .tflite). Defaults to the serving model.")
+    model_group.add_argument('--version', help="Model registry version.")
+    parser.add_argument('--data-dir', default=TEST_DATA_DIR)
+    parser.add_argument('--batch-size', type=int, default=EVALUATION_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="Decode threads (default: min(8, CPUs)).")
+    parser.add_argument('--no-cache', action='store_true', help="Score every image instead of reusing cached predictions.")
+    parser.add_argument('--output', help="Write the full JSON report to this file.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.version:
+        model_path, version = model_registry.model_path(args.version), args.version
+    elif args.model:
+        model_path, version = args.model, None
+    else:
+        model_path, version = get_serving_model_path()
+    serving = load_serving_model(model_path, version, warm_up=False)
+    report = evaluate_serving_model(serving, data_dir=args.data_dir, batch_size=args.batch_size, workers=args.workers,
+                                    cache_dir=None if args.no_cache else EVALUATION_CACHE_DIR)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    json.dump(dict(summarize(report), per_class=report.get("per_class"), confusion_matrix=report.get("confusion_matrix")),
+              sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from src.model import load_model_manifest, save_model_manifest
+from src.prediction import MODEL_PATH, PROJECT_ROOT, TFLiteModel, load_backend_model, model_registry
+from src.data_pipeline import list_image_files
+from src.preprocessing import preprocess_single_image
+from src.registry import TFLITE_FILENAME
+
+TEST_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'test')
+QUANTIZATION_MODES = (None, 'dynamic', 'int8')
+
+logger = logging.getLogger(__name__)
+
+
+def default_tflite_path(model_path, quantization=None):
+    """Returns models/<name>.tflite, or models/<name>.<quantization>.tflite for quantized exports."""
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.{quantization}.tflite" if quantization else f"{base}.tflite"
+
+def list_labeled_images(data_dir, class_names, max_images=None, seed=42, exclude=()):
+    """
+    Returns (image_path, label_index) pairs from the class subdirectories of `data_dir`, with
+    labels indexing `class_names`; images of other classes and paths in `exclude` are left out.
+    When `max_images` is set, returns a reproducible random sample of that size.
+    """
+    paths, labels, class_indices = list_image_files(data_dir)
+    directory_names = sorted(class_indices, key=class_indices.get)
+    label_of = {name: index for index, name in enumerate(class_names)}
+    samples = [(path, label_of[directory_names[label]]) for path, label in zip(paths, labels)
+               if directory_names[label] in label_of and path not in exclude]
+    if max_images is not None and len(samples) > max_images:
+        samples = random.Random(seed).sample(samples, max_images)
+    return samples
+
+def calibration_samples(calibration_dir, num_images):
+    """Returns the (image_path, label_index) pairs int8 calibration uses; the same ones on every call."""
+    class_names = sorted(d for d in os.listdir(calibration_dir) if os.path.isdir(os.path.join(calibration_dir, d)))
+    return list_labeled_images(calibration_dir, class_names, max_images=num_images)
+
+def _representative_dataset(calibration_dir, num_images):
+    """Yields preprocessed test images for int8 calibration."""
+    samples = calibration_samples(calibration_dir, num_images)
+    if not samples:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+
+    def generator():
+        for image_path, _ in samples:
+            try:
+                yield [preprocess_single_image(image_path).astype(np.float32)]
+            except Exception as e:
+                logger.warning("Skipping calibration image %s: %s", image_path, e)
+    return generator
+
+def export_tflite(model_path=MODEL_PATH, output_path=None, quantization=None,
+                  calibration_dir=TEST_DATA_DIR, num_calibration_images=200):
+    """
+    Converts a saved Keras model into a TFLite flatbuffer.
+
+    `quantization` is None (float32), 'dynamic' (int8 weights, float activations) or
+    'int8' (int8 weights and activations, calibrated on images from `calibration_dir`).
+    Input and output tensors stay float32 so the serving code is unchanged.
+    The model's class-name manifest is copied next to the exported file.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantization}. Expected one of {QUANTIZATION_MODES}.")
+    if output_path is None:
+        output_path = default_tflite_path(model_path, quantization)
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        converter.representative_dataset = _representative_dataset(calibration_dir, num_calibration_images)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    start = time.perf_counter()
+    flatbuffer = converter.convert()
+    logger.info("Converted %s (%s) in %.1fs", model_path, quantization or 'float32', time.perf_counter() - start)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp_path, output_path)
+
+    manifest = load_model_manifest(model_path)
+    if manifest:
+        save_model_manifest(output_path, manifest["class_indices"], manifest["input_shape"])
+    logger.info("TFLite model saved to: %s (%.2f MB)", output_path, len(flatbuffer) / 1e6)
+    return output_path
+
+def _evaluate_backend(model, images, labels, batch_size):
+    """Returns the predicted class indices and per-call latencies for batch-1 and batched inference."""
+    single_latencies = []
+    for i in range(min(len(images), 100)):
+        start = time.perf_counter()
+        model.predict(images[i:i + 1], verbose=0)
+        single_latencies.append(time.perf_counter() - start)
+
+    predictions = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        predictions.append(model.predict(images[i:i + batch_size], batch_size=batch_size, verbose=0))
+    batched_seconds = time.perf_counter() - start
+    predictions = np.concatenate(predictions, axis=0)
+
+    single_ms = np.array(single_latencies) * 1000.0
+    return predictions, {
+        "accuracy": float(np.mean(np.argmax(predictions, axis=1) == labels)),
+        "batch1_latency_ms": {
+            "p50": float(np.percentile(single_ms, 50)),
+            "p99": float(np.percentile(single_ms, 99)),
+        },
+        "batched_images_per_sec": float(len(images) / batched_seconds) if batched_seconds else 0.0,
+    }
+
+def compare_backends(model_path, candidate_paths, data_dir=TEST_DATA_DIR, max_images=500,
+                     batch_size=32, max_accuracy_drop=0.01, exclude_paths=()):
+    """
+    Scores the same labelled test images with the Keras model and each exported model,
+    and reports accuracy, agreement with Keras, batch-1 latency and batched throughput.
+    A candidate is marked `safe` when its accuracy is within `max_accuracy_drop` of Keras.
+    Pass the int8 calibration images as `exclude_paths` so they are not scored as well.
+    """
+    manifest = load_model_manifest(model_path)
+    if manifest:
+        class_names = sorted(manifest["class_indices"], key=manifest["class_indices"].get)
+    else:
+        class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    exclude_paths = set(exclude_paths)
+    samples = list_labeled_images(data_dir, class_names, max_images=max_images, exclude=exclude_paths)
+    if not samples:
+        raise ValueError(f"No labelled images found in {data_dir}")
+
+    images = np.concatenate([preprocess_single_image(path) for path, _ in samples], axis=0).astype(np.float32)
+    labels = np.array([label for _, label in samples])
+
+    reference_predictions, reference = _evaluate_backend(load_backend_model(model_path), images, labels, batch_size)
+    report = {
+        "num_images": len(samples),
+        "num_excluded": len(exclude_paths),
+        "class_names": class_names,
+        "reference": dict(reference, backend='keras', model_path=model_path),
+        "candidates": [],
+    }
+    reference_classes = np.argmax(reference_predictions, axis=1)
+    for candidate_path in candidate_paths:
+        predictions, result = _evaluate_backend(TFLiteModel(candidate_path), images, labels, batch_size)
+        result.update({
+            "backend": 'tflite',
+            "model_path": candidate_path,
+            "size_mb": os.path.getsize(candidate_path) / 1e6,
+            "agreement_with_reference": float(np.mean(np.argmax(predictions, axis=1) == reference_classes)),
+            "max_abs_prob_diff": float(np.max(np.abs(predictions - reference_predictions))),
+            "speedup_batch1_p50": reference["batch1_latency_ms"]["p50"] / result["batch1_latency_ms"]["p50"],
+        })
+        result["safe"] = result["accuracy"] >= reference["accuracy"] - max_accuracy_drop
+        report["candidates"].append(result)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the trained model to TFLite and compare backends.")
+    parser.add_argument('--model', default=MODEL_PATH, help="Path of the trained Keras .h5 model.")
+    parser.add_argument('--quantization', choices=['none', 'dynamic', 'int8', 'all'], default='none')
+    parser.add_argument('--output', default=None, help="Output .tflite path (single quantization mode only).")
+    parser.add_argument('--calibration-dir', default=TEST_DATA_DIR)
+    parser.add_argument('--calibration-images', type=int, default=200)
+    parser.add_argument('--compare', action='store_true', help="Print an accuracy-vs-latency report against Keras.")
+    parser.add_argument('--compare-images', type=int, default=500)
+    parser.add_argument('--report', default=None, help="Also write the comparison report to this JSON file.")
+    parser.add_argument('--publish', action='store_true',
+                        help="Publish the model and its export as a new registry version (single quantization mode only).")
+    args = parser.parse_args()
+    if args.publish and args.quantization == 'all':
+        parser.error("--publish needs a single --quantization mode")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    modes = [None, 'dynamic', 'int8'] if args.quantization == 'all' else [None if args.quantization == 'none' else args.quantization]
+    exported = [
+        export_tflite(args.model, args.output if len(modes) == 1 else None, mode,
+                      calibration_dir=args.calibration_dir, num_calibration_images=args.calibration_images)
+        for mode in modes
+    ]
+
+    if args.publish:
+        # The registry serves a version's own model.tflite; TFLITE_MODEL_PATH only applies before anything is published
+        version = model_registry.publish(args.model, move=False, extra_files={TFLITE_FILENAME: exported[0]},
+                                         metadata={"source_model_path": args.model, "tflite_quantization": modes[0] or 'float32'})
+        print(f"Published {args.model} with its {modes[0] or 'float32'} TFLite export as version {version}. "
+              f"Serve it with POST /models/{version}/activate.")
+
+    if args.compare:
+        # Images the int8 model was calibrated on would flatter its accuracy, so they are held out
+        calibration_paths = ([path for path, _ in calibration_samples(args.calibration_dir, args.calibration_images)]
+                             if 'int8' in modes else [])
+        report = compare_backends(args.model, exported, data_dir=args.calibration_dir, max_images=args.compare_images,
+                                  exclude_paths=calibration_paths)
+        print(json.dumps(report, indent=2))
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
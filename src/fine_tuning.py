@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+from src.data_pipeline import create_record_dataset, list_image_files
+
+REPLAY_RATIO = 1.0 # Replayed old images per new image
+MAX_REPLAY_SAMPLES = 2000
+VALIDATION_SPLIT = 0.2
+EARLY_STOPPING_PATIENCE = 2
+
+
+def merge_class_indices(base_class_indices, new_class_names):
+    """
+    Returns the class indices of the fine-tuned model: existing classes keep their index,
+    classes only present in the new data are appended in sorted order.
+    """
+    merged = dict(base_class_indices)
+    for name in sorted(set(new_class_names) - set(merged)):
+        merged[name] = len(merged)
+    return merged
+
+def sample_replay_data(replay_dir, class_indices, num_samples, rng):
+    """
+    Draws up to `num_samples` images from the original training data, spread evenly over
+    the classes `class_indices` knows. Returns (paths, labels) with labels remapped to
+    `class_indices`.
+    """
+    if num_samples <= 0 or not os.path.isdir(replay_dir):
+        return [], []
+    paths, labels, replay_indices = list_image_files(replay_dir)
+    by_class = {}
+    for path, label in zip(paths, labels):
+        by_class.setdefault(label, []).append(path)
+    replay_classes = [(name, index) for name, index in replay_indices.items() if name in class_indices and index in by_class]
+    if not replay_classes:
+        return [], []
+
+    per_class = max(1, num_samples // len(replay_classes))
+    sampled_paths, sampled_labels = [], []
+    for name, index in replay_classes:
+        candidates = by_class[index]
+        for i in rng.choice(len(candidates), size=min(per_class, len(candidates)), replace=False):
+            sampled_paths.append(candidates[i])
+            sampled_labels.append(class_indices[name])
+    return sampled_paths, sampled_labels
+
+def build_fine_tuning_datasets(new_samples, new_class_indices, base_class_indices, replay_dir, batch_size=32,
+                               replay_ratio=REPLAY_RATIO, max_replay_samples=MAX_REPLAY_SAMPLES,
+                               validation_split=VALIDATION_SPLIT, read_member=None, seed=None):
+    """
+    Mixes the new training data with a replay sample of the old training data and splits
+    the result into training and validation pipelines.
+
+    `new_samples` is (paths, member_indices, labels) as taken by create_record_dataset, with
+    labels indexed by `new_class_indices`; they are remapped onto the merged class indices.
+    Returns (train_data, validation_data, class_indices, num_train, num_validation, num_replay);
+    validation_data is None when the split leaves no images for it.
+    """
+    rng = np.random.default_rng(seed)
+    class_indices = merge_class_indices(base_class_indices, new_class_indices)
+    new_names = {index: name for name, index in new_class_indices.items()}
+
+    paths, member_indices, labels = new_samples
+    paths = list(paths) if paths is not None else [''] * len(labels)
+    member_indices = list(member_indices) if member_indices is not None else [-1] * len(labels)
+    labels = [class_indices[new_names[label]] for label in labels]
+
+    num_replay = min(int(len(labels) * replay_ratio), max_replay_samples)
+    replay_paths, replay_labels = sample_replay_data(replay_dir, base_class_indices, num_replay, rng)
+    paths += replay_paths
+    member_indices += [-1] * len(replay_paths)
+    labels += replay_labels
+
+    order = rng.permutation(len(labels))
+    num_validation = int(len(order) * validation_split)
+    splits = {'validation': order[:num_validation], 'train': order[num_validation:]}
+
+    def dataset(indices, is_training):
+        if len(indices) == 0:
+            return None
+        return create_record_dataset([paths[i] for i in indices], [member_indices[i] for i in indices],
+                                     [labels[i] for i in indices], read_member=read_member,
+                                     batch_size=batch_size, shuffle=is_training, is_training=is_training)
+
+    return (dataset(splits['train'], True), dataset(splits['validation'], False), class_indices,
+            len(splits['train']), num_validation, len(replay_paths))
+
+def load_base_model(base_model_path):
+    """
+    Loads the model to fine-tune and returns (model, class_indices). Class indices come from
+    the model's manifest; models saved without one are assumed to use the sorted class
+    subdirectories of the original training data.
+    """
+    from tensorflow.keras.models import load_model
+    from src.model import load_model_manifest
+
+    if not base_model_path or not os.path.exists(base_model_path):
+        raise FileNotFoundError(f"No trained model to fine-tune at {base_model_path}")
+    model = load_model(base_model_path)
+    manifest = load_model_manifest(base_model_path)
+    if manifest and manifest.get("class_indices"):
+        return model, manifest["class_indices"]
+
+    from src.prediction import TRAIN_DATA_DIR, CLASS_NAMES
+    class_names = CLASS_NAMES
+    if os.path.isdir(TRAIN_DATA_DIR):
+        class_names = sorted(d for d in os.listdir(TRAIN_DATA_DIR) if os.path.isdir(os.path.join(TRAIN_DATA_DIR, d)))
+    if len(class_names) != model.output_shape[-1]:
+        raise ValueError(f"Cannot tell the class names of {base_model_path}; it has no manifest.")
+    return model, {name: index for index, name in enumerate(class_names)}
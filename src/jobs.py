@@ -0,0 +1,441 @@
+import atexit
+import fcntl
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+# 'trained' means the new model is saved; the serving process marks the job 'completed' once it has switched to it,
+# or 'rejected' if it decided not to (see RetrainJobManager)
+JOB_PHASES = ('queued', 'extracting', 'loading_data', 'building_model', 'training', 'saving', 'exporting', 'trained',
+              'completed', 'rejected', 'failed')
+FINISHED_PHASES = ('completed', 'rejected', 'failed')
+STATUS_FILENAME = 'status.json'
+# Held by whichever process is running a job, so every worker sharing a jobs directory runs one job at a time
+RUNNER_LOCK_FILENAME = '.runner.lock'
+QUEUE_POLL_SECONDS = 5
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TRAIN_BATCH_SIZE = 32
+
+logger = logging.getLogger(__name__)
+
+
+def _write_status(status_path, status):
+    tmp_path = f"{status_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, status_path)
+
+def _read_status(status_path):
+    try:
+        with open(status_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _limit_process_resources(num_threads, niceness):
+    """
+    Caps the threads TensorFlow and the numeric libraries may use in this process and
+    lowers its scheduling priority, so training does not starve the serving process.
+    Must run before TensorFlow is imported.
+    """
+    if num_threads:
+        for variable in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            os.environ[variable] = str(num_threads)
+        os.environ['TF_NUM_INTEROP_THREADS'] = '1' if num_threads <= 2 else '2'
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    if niceness and hasattr(os, 'nice'):
+        try:
+            os.nice(niceness)
+        except OSError:
+            pass
+
+def _load_training_data(extracted_data_dir, input_pipeline):
+    """Returns (train_data, class_indices, num_samples) using the configured input pipeline."""
+    if input_pipeline == 'tf_data':
+        from src.data_pipeline import create_tf_dataset, list_image_files, tf_decodable_files
+        # Counts only the images the tf.data pipeline can decode, so steps and ETA match what it trains on
+        paths, labels, class_indices = tf_decodable_files(list_image_files(extracted_data_dir))
+        if not paths:
+            return None, class_indices, 0
+        train_data, class_indices = create_tf_dataset(extracted_data_dir, batch_size=TRAIN_BATCH_SIZE, is_training=True,
+                                                      files=(paths, labels, class_indices))
+        return train_data, class_indices, len(paths)
+
+    from src.preprocessing import create_data_generator
+    train_generator, class_indices = create_data_generator(extracted_data_dir, batch_size=TRAIN_BATCH_SIZE, is_training=True)
+    return train_generator, class_indices, train_generator.samples
+
+def _prepare_fine_tuning(zip_path, work_dir, config, report):
+    """
+    Loads the serving model and the uploaded data for incremental training: the new images
+    are mixed with a replay sample of the original training data, a validation split is held
+    out for early stopping, and the output head is expanded if the upload adds classes.
+    Returns (model, train_data, validation_data, class_indices, num_train, zip_source).
+    """
+    from src.fine_tuning import build_fine_tuning_datasets, load_base_model
+    from src.model import prepare_for_fine_tuning
+
+    zip_source = None
+    if config['data_source'] == 'zip_stream':
+        from src.zip_data import ZipImageSource
+        report('loading_data', data_source='zip_stream', input_pipeline='tf_data', mode='fine_tune')
+        zip_source = ZipImageSource(zip_path)
+        new_samples = (None, list(range(len(zip_source))), zip_source.labels)
+        new_class_indices = zip_source.class_indices
+        read_member = zip_source.read
+    else:
+        from src.data_pipeline import list_image_files
+        from src.preprocessing import load_and_preprocess_bulk_data
+        report('extracting', mode='fine_tune')
+        extracted_data_dir = load_and_preprocess_bulk_data(zip_path, extract_to_dir=os.path.join(work_dir, 'data'))
+        report('loading_data', data_source='extract', input_pipeline='tf_data', mode='fine_tune')
+        paths, labels, new_class_indices = list_image_files(extracted_data_dir)
+        new_samples = (paths, None, labels)
+        read_member = None
+    if not new_samples[2]:
+        raise ValueError("The PyDataset has length 0. No images found in the provided zip data.")
+
+    report('building_model', base_model_path=config['base_model_path'])
+    base_model, base_class_indices = load_base_model(config['base_model_path'])
+    train_data, validation_data, class_indices, num_train, num_validation, num_replay = build_fine_tuning_datasets(
+        new_samples, new_class_indices, base_class_indices, config['replay_data_dir'], batch_size=TRAIN_BATCH_SIZE,
+        replay_ratio=config['replay_ratio'], max_replay_samples=config['max_replay_samples'],
+        validation_split=config['validation_split'], read_member=read_member)
+    model = prepare_for_fine_tuning(base_model, len(class_indices), freeze_conv=config['freeze_conv'])
+    report('building_model', samples=num_train, validation_samples=num_validation, replay_samples=num_replay,
+           new_classes=list(class_indices.keys()),
+           added_classes=[name for name in class_indices if name not in base_class_indices])
+    return model, train_data, validation_data, class_indices, num_train, zip_source
+
+def _run_retrain_job(job_id, zip_path, work_dir, output_model_path, config):
+    """
+    Entry point of the training process: extracts the uploaded data, trains a new model and
+    saves it to `output_model_path`, reporting progress to <work_dir>/status.json as it goes.
+    `config` holds the RetrainJobManager settings (epochs, num_threads, niceness, input_pipeline, data_source,
+    mode and the fine-tuning options). With data_source 'zip_stream' the images are read straight from
+    the zip and nothing is extracted. With mode 'fine_tune' the serving model at config['base_model_path']
+    is trained further instead of a new model being trained from scratch.
+    With config['tflite_quantization'] set ('float32', 'dynamic' or 'int8'), the trained model is also
+    exported to model.tflite next to it, so the registry version can be served by the TFLite backend.
+    """
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    epochs = config['epochs']
+    num_threads = config['num_threads']
+    _limit_process_resources(num_threads, config['niceness'])
+    status_path = os.path.join(work_dir, STATUS_FILENAME)
+    status = _read_status(status_path) or {"job_id": job_id}
+    started = time.time()
+    status.update({"started_at": started, "epochs": epochs, "num_threads": num_threads, "mode": config['mode']})
+
+    def report(phase, **fields):
+        status.update(fields, phase=phase, updated_at=time.time())
+        _write_status(status_path, status)
+
+    zip_source = None
+    try:
+        import tensorflow as tf
+        if num_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(int(os.environ['TF_NUM_INTEROP_THREADS']))
+
+        from src.preprocessing import load_and_preprocess_bulk_data
+        from src.model import create_cnn_model, train_model
+
+        if config['mode'] == 'fine_tune':
+            model, train_data, validation_data, class_indices, num_samples, zip_source = _prepare_fine_tuning(
+                zip_path, work_dir, config, report)
+        else:
+            if config['data_source'] == 'zip_stream':
+                from src.zip_data import create_zip_dataset
+                report('loading_data', data_source='zip_stream', input_pipeline='tf_data')
+                train_data, class_indices, num_samples, zip_source = create_zip_dataset(zip_path, batch_size=TRAIN_BATCH_SIZE)
+            else:
+                report('extracting')
+                extracted_data_dir = load_and_preprocess_bulk_data(zip_path, extract_to_dir=os.path.join(work_dir, 'data'))
+
+                report('loading_data', data_source='extract', input_pipeline=config['input_pipeline'])
+                train_data, class_indices, num_samples = _load_training_data(extracted_data_dir, config['input_pipeline'])
+            if num_samples == 0:
+                raise ValueError("The PyDataset has length 0. No images found in the provided zip data.")
+            report('building_model', samples=num_samples, new_classes=list(class_indices.keys()))
+            model = create_cnn_model(num_classes=len(class_indices))
+            validation_data = None
+
+        callbacks = [_make_progress_callback(report, epochs, math.ceil(num_samples / TRAIN_BATCH_SIZE))]
+        if validation_data is not None:
+            callbacks.append(tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=config['early_stopping_patience'],
+                                                              restore_best_weights=True))
+        report('training', epoch=0)
+        history = train_model(model, train_data, epochs=epochs, model_save_path=output_model_path,
+                              class_indices=class_indices, callbacks=callbacks, validation_data=validation_data)
+        if history.history.get('val_loss'):
+            # With restore_best_weights the saved model is the one from the best validation epoch
+            best = min(range(len(history.history['val_loss'])), key=history.history['val_loss'].__getitem__)
+            status.update(epochs_run=len(history.history['val_loss']),
+                          val_loss=float(history.history['val_loss'][best]),
+                          val_accuracy=float(history.history.get('val_accuracy', [0.0] * (best + 1))[best]))
+
+        tflite_quantization = config.get('tflite_quantization')
+        if tflite_quantization:
+            from src.export import export_tflite
+            report('exporting', tflite_quantization=tflite_quantization)
+            tflite_path = export_tflite(output_model_path, os.path.join(os.path.dirname(output_model_path), 'model.tflite'),
+                                        quantization=None if tflite_quantization == 'float32' else tflite_quantization,
+                                        calibration_dir=config['tflite_calibration_dir'])
+            status.update(tflite_model_path=tflite_path)
+
+        report('trained', model_path=output_model_path, eta_seconds=0, duration_seconds=time.time() - started)
+    except Exception as e:
+        logger.exception("Retraining error: %s", e)
+        report('failed', error=f"Retraining failed: {str(e)}", duration_seconds=time.time() - started)
+    finally:
+        if zip_source is not None:
+            zip_source.close()
+        extracted = os.path.join(work_dir, 'data')
+        if os.path.exists(extracted):
+            shutil.rmtree(extracted, ignore_errors=True)
+
+
+def _make_progress_callback(report, epochs, steps_per_epoch, min_interval=2.0):
+    """Builds a Keras callback that reports epoch, batch, loss/accuracy and ETA through `report`."""
+    import tensorflow as tf
+
+    class ProgressCallback(tf.keras.callbacks.Callback):
+        def on_train_begin(self, logs=None):
+            self.train_start = time.time()
+            self.last_report = 0.0
+
+        def _eta(self, epochs_done):
+            elapsed = time.time() - self.train_start
+            return elapsed / epochs_done * (epochs - epochs_done) if epochs_done > 0 else None
+
+        def on_train_batch_end(self, batch, logs=None):
+            now = time.time()
+            if now - self.last_report < min_interval:
+                return
+            self.last_report = now
+            logs = logs or {}
+            epochs_done = self.current_epoch + (batch + 1) / max(steps_per_epoch, 1)
+            report('training', epoch=self.current_epoch + 1, batch=batch + 1, steps_per_epoch=steps_per_epoch,
+                   loss=float(logs.get('loss', 0.0)), accuracy=float(logs.get('accuracy', 0.0)),
+                   eta_seconds=self._eta(epochs_done))
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.current_epoch = epoch
+
+        def on_epoch_end(self, epoch, logs=None):
+            logs = logs or {}
+            self.last_report = time.time()
+            report('training' if epoch + 1 < epochs else 'saving', epoch=epoch + 1, batch=steps_per_epoch,
+                   steps_per_epoch=steps_per_epoch,
+                   loss=float(logs.get('loss', 0.0)), accuracy=float(logs.get('accuracy', 0.0)),
+                   eta_seconds=self._eta(epoch + 1))
+
+    return ProgressCallback()
+
+
+class RetrainJobManager:
+    """
+    Runs retraining jobs one at a time in a separate, resource-limited process.
+
+    The queue lives in `jobs_dir`: a job is queued by writing its status, and every manager sharing
+    the directory (one per gunicorn worker) takes an exclusive lock on it before claiming the oldest
+    queued job. Only one job trains at a time across workers, and a job queued by a worker that
+    restarts is still run by another. A job found mid-run while the lock is free lost its runner and
+    is marked 'failed'.
+
+    `submit()` returns a job id immediately; the job's phase, epoch, loss/accuracy and ETA
+    are read back with `get()`. The serving process keeps using its current model while a
+    job runs; when a job completes, `on_model_ready(job)` is called with the finished job
+    status (including `model_path`) so the caller can switch to the new model. Any dict it
+    returns is merged into the job's final status; if it sets `promoted` to False (e.g. the
+    model failed an evaluation gate), the job ends in the 'rejected' phase instead of 'completed'.
+    """
+
+    def __init__(self, jobs_dir, on_model_ready=None, epochs=10, num_threads=None, niceness=10,
+                 input_pipeline='generator', data_source='extract', mode='scratch', base_model_resolver=None,
+                 replay_data_dir=None, replay_ratio=1.0, max_replay_samples=2000, validation_split=0.2,
+                 freeze_conv=True, early_stopping_patience=2, tflite_quantization=None, tflite_calibration_dir=None):
+        self.jobs_dir = jobs_dir
+        self.on_model_ready = on_model_ready
+        self.config = {
+            "epochs": epochs,
+            "num_threads": num_threads,
+            "niceness": niceness,
+            "input_pipeline": input_pipeline, # 'generator' (ImageDataGenerator) or 'tf_data'
+            "data_source": data_source, # 'extract' the zip to disk, or 'zip_stream' images straight out of it
+            "mode": mode, # 'scratch' trains a new model, 'fine_tune' continues training the serving model
+            "replay_data_dir": replay_data_dir,
+            "replay_ratio": replay_ratio,
+            "max_replay_samples": max_replay_samples,
+            "validation_split": validation_split,
+            "freeze_conv": freeze_conv,
+            "early_stopping_patience": early_stopping_patience,
+            # None skips the TFLite export; 'float32', 'dynamic' or 'int8' exports model.tflite with that quantization
+            "tflite_quantization": tflite_quantization,
+            "tflite_calibration_dir": tflite_calibration_dir, # Images used to calibrate 'int8' exports
+        }
+        self.base_model_resolver = base_model_resolver # Returns the Keras model path to fine-tune
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._process = None
+        atexit.register(self._stop_running_job)
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._start_worker() # Picks up jobs left queued by a worker that has exited
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='retrain-jobs', daemon=True)
+                self._worker.start()
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def create_job_dir(self):
+        """Reserves a new job id and returns (job_id, job_dir) so the upload can be saved into it."""
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        return job_id, job_dir
+
+    def submit(self, job_id, zip_path, mode=None):
+        """
+        Queues a retraining job for data already saved at `zip_path` inside the job's directory.
+        `mode` ('scratch' or 'fine_tune') overrides the manager's default for this job.
+        """
+        mode = mode or self.config['mode']
+        if mode not in ('scratch', 'fine_tune'):
+            raise ValueError(f"Unknown retraining mode: {mode}")
+        status = {"job_id": job_id, "phase": 'queued', "mode": mode, "upload": os.path.basename(zip_path),
+                  "created_at": time.time(), "updated_at": time.time()}
+        _write_status(os.path.join(self._job_dir(job_id), STATUS_FILENAME), status)
+        self._start_worker()
+        self._wakeup.set()
+        return dict(status, finished=False)
+
+    def get(self, job_id):
+        """
+        Returns the latest status of a job, or None if the job does not exist.
+        `finished` tells whether the job has reached one of the FINISHED_PHASES.
+        """
+        if not job_id.isalnum():
+            return None
+        status = _read_status(os.path.join(self._job_dir(job_id), STATUS_FILENAME))
+        if status is not None:
+            status["finished"] = status.get("phase") in FINISHED_PHASES
+        return status
+
+    def list_jobs(self):
+        """Returns the status of every known job, newest first."""
+        jobs = []
+        for job_id in os.listdir(self.jobs_dir):
+            status = self.get(job_id)
+            if status:
+                jobs.append(status)
+        return sorted(jobs, key=lambda job: job.get("created_at", 0), reverse=True)
+
+    def _run(self):
+        lock_path = os.path.join(self.jobs_dir, RUNNER_LOCK_FILENAME)
+        while True:
+            job = None
+            with open(lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX) # Waits while another worker runs a job
+                try:
+                    job = self._claim_next_job()
+                    if job is not None:
+                        self._run_job(job["job_id"], os.path.join(self._job_dir(job["job_id"]), job["upload"]), job["mode"])
+                except Exception as e:
+                    logger.exception("Retraining error: the job runner failed: %s", e)
+                    if job is not None:
+                        self._fail_job(job, f"Retraining could not be run: {str(e)}")
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            if job is None:
+                # Jobs queued by other workers are only seen by polling
+                self._wakeup.wait(QUEUE_POLL_SECONDS)
+                self._wakeup.clear()
+
+    def _claim_next_job(self):
+        """
+        Returns the oldest queued job, or None. Must be called with the runner lock held, so a job
+        in any other unfinished phase was being run by a process that has since died.
+        """
+        queued = []
+        for status in self.list_jobs():
+            phase = status.get("phase")
+            if phase == 'queued':
+                queued.append(status)
+            elif phase in JOB_PHASES and phase not in FINISHED_PHASES:
+                logger.warning("Retraining job %s was interrupted in phase '%s'; marking it failed", status["job_id"], phase)
+                self._fail_job(status, f"Retraining was interrupted in phase '{phase}' by a worker restart.")
+        for status in sorted(queued, key=lambda job: job.get("created_at", 0)):
+            if status.get("upload") and os.path.exists(os.path.join(self._job_dir(status["job_id"]), status["upload"])):
+                return status
+            self._fail_job(status, "The uploaded training data is missing.")
+        return None
+
+    def _fail_job(self, status, error):
+        status.pop("finished", None)
+        status.update(phase='failed', updated_at=time.time(), error=error)
+        _write_status(os.path.join(self._job_dir(status["job_id"]), STATUS_FILENAME), status)
+
+    def _run_job(self, job_id, zip_path, mode):
+        job_dir = self._job_dir(job_id)
+        config = dict(self.config, mode=mode)
+        if mode == 'fine_tune':
+            # Resolved when the job starts, so it builds on any model activated while it was queued
+            config['base_model_path'] = self.base_model_resolver() if self.base_model_resolver else None
+        status_path = os.path.join(job_dir, STATUS_FILENAME)
+        output_model_path = os.path.join(job_dir, 'model.h5')
+        # A fresh interpreter running this module (never a fork of a process with TensorFlow loaded).
+        # Unlike a multiprocessing spawn, it does not re-import the serving app's __main__ module, so
+        # TensorFlow is first imported by the job itself, after its thread limits are set.
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get('PYTHONPATH')])))
+        process = subprocess.Popen([sys.executable, '-m', 'src.jobs',
+                                    json.dumps([job_id, zip_path, job_dir, output_model_path, config])], env=env)
+        self._process = process
+        exitcode = process.wait()
+        self._process = None
+
+        status = _read_status(status_path) or {"job_id": job_id}
+        if status.get("phase") == 'trained':
+            try:
+                if self.on_model_ready is not None:
+                    status.update(self.on_model_ready(status) or {})
+                if status.get("promoted") is False:
+                    status.update(phase='rejected', updated_at=time.time(),
+                                  message="The retrained model was not promoted: " + "; ".join(status.get("rejection_reasons", [])))
+                else:
+                    status.update(phase='completed', updated_at=time.time(),
+                                  message="Model retraining triggered and completed successfully!")
+            except Exception as e:
+                logger.exception("Retraining error: could not activate the new model: %s", e)
+                status.update(phase='failed', updated_at=time.time(), error=f"Activating the new model failed: {str(e)}")
+        elif status.get("phase") != 'failed':
+            status.update(phase='failed', updated_at=time.time(),
+                          error=f"Retraining process exited unexpectedly (exit code {exitcode}).")
+        _write_status(status_path, status)
+
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    def _stop_running_job(self):
+        # Training must not outlive the serving process that would activate its model
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    # Entry point of the training process started by RetrainJobManager._run_job
+    _run_retrain_job(*json.loads(sys.argv[1]))
@@ -0,0 +1,270 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Request/stage latencies range from sub-millisecond decodes to multi-second batch requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Base class of the metric types. A metric declared with `labelnames` is used through
+    `labels(...)`, which returns (and caches) the child for one combination of label
+    values; a metric without labels is its own single child.
+    """
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def clear(self):
+        """Drops every labelled child (e.g. to retire an old model version label)."""
+        with self._lock:
+            if self.labelnames:
+                self._children.clear()
+
+    def __getattr__(self, attribute):
+        # Unlabelled metrics forward inc/set/observe/... to their single child
+        children = self.__dict__.get('_children')
+        if children is not None and () in children:
+            return getattr(children[()], attribute)
+        raise AttributeError(attribute)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+    def collect(self, extra_labels=()):
+        """Returns the sample lines of this metric, each also carrying `extra_labels` (name, value) pairs."""
+        lines = []
+        for key, child in sorted(self._children.copy().items()):
+            lines.extend(child.samples(self.name, self.labelnames, key, extra_labels))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+    def samples(self, name, labelnames, key, extra=()):
+        return [f'{name}{_format_labels(labelnames, key, extra)} {_format_value(self._value)}']
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. requests or errors. Name it with a `_total` suffix."""
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    __slots__ = ('_value', '_lock', '_function')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set(self, value):
+        self._value = float(value)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function):
+        """Reads the value from `function()` at scrape time instead of tracking it."""
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def get(self):
+        return float(self._function()) if self._function is not None else self._value
+
+    def samples(self, name, labelnames, key, extra=()):
+        return [f'{name}{_format_labels(labelnames, key, extra)} {_format_value(self.get())}']
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. requests in flight or queue depth."""
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    __slots__ = ('_upper_bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, buckets):
+        self._upper_bounds = buckets
+        self._counts = [0] * (len(buckets) + 1) # Last slot is the +Inf bucket
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes the wall-clock duration of the `with` block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labelnames, key, extra=()):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for upper_bound, count in zip(self._upper_bounds + (math.inf,), counts):
+            cumulative += count
+            le = ("le", _format_value(float(upper_bound)))
+            lines.append(f'{name}_bucket{_format_labels(labelnames, key, list(extra) + [le])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, key, extra)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, key, extra)} {cumulative}')
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Counts observations (e.g. latencies) into cumulative buckets. Observing is one bisect and
+    one short lock, so it is cheap enough for every request.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def collect(self, extra_labels=()):
+        """Returns {metric name: sample lines}, every sample also carrying `extra_labels`."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.collect(extra_labels) for metric in metrics}
+
+    def render(self, extra_labels=(), other_samples=()):
+        """
+        Renders every metric. `other_samples` are further collect() results (e.g. other worker
+        processes' snapshots), listed under this registry's metric of the same name.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect(extra_labels))
+            for samples in other_samples:
+                lines.extend(samples.get(metric.name, ()))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Metrics of the prediction API, served by GET /metrics
+HTTP_REQUESTS = Counter('http_requests_total', "HTTP requests by endpoint and status code.", ['endpoint', 'status'])
+HTTP_REQUEST_DURATION = Histogram('http_request_duration_seconds', "HTTP request latency by endpoint.", ['endpoint'])
+HTTP_REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', "HTTP requests currently being handled, by endpoint.", ['endpoint'])
+PREDICT_STAGE_DURATION = Histogram(
+    'predict_stage_duration_seconds',
+    "Time spent in each stage of a prediction: receive (upload read), decode (decode and resize), "
+    "normalize, forward (model forward pass, per batch) and serialize.",
+    ['stage'])
+PREDICTION_ERRORS = Counter('prediction_errors_total', "Failed predictions by endpoint.", ['endpoint'])
+REQUESTS_REJECTED = Counter('http_requests_rejected_total',
+                            "Requests shed by admission control, by endpoint and reason (too_large, busy, saturated).",
+                            ['endpoint', 'reason'])
+PREDICTION_CACHE_LOOKUPS = Counter('prediction_cache_lookups_total', "Prediction cache lookups by result (hit or miss).", ['result'])
+INFERENCE_BATCH_SIZE = Histogram('inference_batch_size', "Images per model forward pass.", buckets=BATCH_SIZE_BUCKETS)
+BATCH_QUEUE_DEPTH = Gauge('inference_queue_depth', "Prediction requests waiting for the batching engine.")
+MODEL_INFO = Gauge('model_info', "The serving model version (value is always 1).", ['version', 'backend'])
+MODEL_SWAPS = Counter('model_swaps_total', "Times the serving model was replaced.")
+
+
+def render_metrics(extra_labels=(), other_samples=()):
+    """Returns (body, content_type) for a /metrics response; see MetricsRegistry.render."""
+    return REGISTRY.render(extra_labels, other_samples), CONTENT_TYPE
@@ -2,10 +2,13 @@ import tensorflow as tf
 from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
 import os
+import json
+import numpy as np
 
 IMG_HEIGHT = 128
 IMG_WIDTH = 128
 NUM_CLASSES = 2 # Default, will be updated based on data in retraining
+FINE_TUNE_LEARNING_RATE = 1e-4
 
 def create_cnn_model(input_shape=(IMG_HEIGHT, IMG_WIDTH, 3), num_classes=NUM_CLASSES):
     """
@@ -29,16 +32,90 @@ def create_cnn_model(input_shape=(IMG_HEIGHT, IMG_WIDTH, 3), num_classes=NUM_CLA
                   metrics=['accuracy'])
     return model
 
-def train_model(model, train_generator, epochs=10, model_save_path='../models/image_classifier_model.tf'):
+def expand_output_head(model, num_classes):
     """
-    Trains the given model using the provided data generator and saves it.
+    Returns a model with the same architecture and weights whose final Dense layer has
+    `num_classes` outputs. Existing classes keep their learned weights (and indices);
+    the weights of added classes are freshly initialized.
+    """
+    old_num_classes = model.output_shape[-1]
+    if num_classes == old_num_classes:
+        return model
+    if num_classes < old_num_classes:
+        raise ValueError(f"Cannot shrink the output head from {old_num_classes} to {num_classes} classes.")
+
+    expanded = create_cnn_model(input_shape=model.input_shape[1:], num_classes=num_classes)
+    for old_layer, new_layer in zip(model.layers[:-1], expanded.layers[:-1]):
+        new_layer.set_weights(old_layer.get_weights())
+
+    old_kernel, old_bias = model.layers[-1].get_weights()
+    new_kernel, new_bias = expanded.layers[-1].get_weights()
+    new_kernel[:, :old_num_classes] = old_kernel
+    new_bias[:old_num_classes] = old_bias
+    new_bias[old_num_classes:] = np.mean(old_bias) # Start new classes on par with the existing ones
+    expanded.layers[-1].set_weights([new_kernel, new_bias])
+    return expanded
+
+def prepare_for_fine_tuning(model, num_classes, freeze_conv=True, learning_rate=FINE_TUNE_LEARNING_RATE):
+    """
+    Prepares a trained model for incremental training: expands its output head to
+    `num_classes` if needed, optionally freezes the convolutional layers, and recompiles
+    it with a lower learning rate.
+    """
+    model = expand_output_head(model, num_classes)
+    for layer in model.layers:
+        layer.trainable = not (freeze_conv and isinstance(layer, Conv2D))
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+def get_manifest_path(model_path):
+    """Returns the path of the sidecar manifest stored next to a saved model."""
+    return os.path.splitext(model_path)[0] + '.manifest.json'
+
+def save_model_manifest(model_path, class_indices, input_shape):
+    """
+    Writes the class indices and input shape of a saved model to its sidecar manifest,
+    so serving can resolve class names without scanning the training data.
+    """
+    manifest = {
+        "class_indices": {name: int(index) for name, index in class_indices.items()},
+        "input_shape": [int(dim) for dim in input_shape],
+    }
+    manifest_path = get_manifest_path(model_path)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+def load_model_manifest(model_path):
+    """Returns the sidecar manifest for a saved model, or None if there is none."""
+    manifest_path = get_manifest_path(model_path)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def train_model(model, train_generator, epochs=10, model_save_path='../models/image_classifier_model.tf', class_indices=None, callbacks=None,
+                validation_data=None):
+    """
+    Trains the given model using the provided data generator and saves it,
+    along with a manifest of its class indices and input shape.
     """
     print(f"Starting training for {epochs} epochs...")
     history = model.fit(
         train_generator,
-        epochs=epochs
+        epochs=epochs,
+        callbacks=callbacks,
+        validation_data=validation_data
     )
     os.makedirs(os.path.dirname(model_save_path), exist_ok=True)
     model.save(model_save_path)
     print(f"Model saved to: {model_save_path}")
+    if class_indices is None:
+        class_indices = getattr(train_generator, 'class_indices', None)
+    if class_indices:
+        save_model_manifest(model_save_path, class_indices, model.input_shape[1:])
     return history
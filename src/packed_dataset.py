@@ -0,0 +1,193 @@
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from src.data_pipeline import list_image_files
+from src.preprocessing import IMG_HEIGHT, IMG_WIDTH, decode_image_into
+
+INDEX_FILENAME = 'index.json'
+LABELS_FILENAME = 'labels.npy'
+SHARD_PATTERN = 'images-{:05d}.npy'
+DEFAULT_SHARD_SIZE = 2048 # Images per shard (about 100 MB of uint8 pixels)
+PACKED_FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def is_packed_dataset(path):
+    """Returns True if `path` is a directory written by pack_dataset."""
+    return os.path.isfile(os.path.join(path, INDEX_FILENAME))
+
+def _decode(path, out):
+    try:
+        decode_image_into(path, out)
+        return True
+    except Exception as e:
+        logger.warning("Skipping unreadable image %s: %s", path, e)
+        return False
+
+def pack_dataset(data_dir, output_dir, shard_size=DEFAULT_SHARD_SIZE, max_workers=None):
+    """
+    Decodes and resizes every image under <data_dir>/<class>/ once, like preprocess_single_image
+    without the rescale, and stores them as fixed-shape (N, IMG_HEIGHT, IMG_WIDTH, 3) uint8 .npy
+    shards plus labels.npy and an index.json with the class indices and source paths.
+    Unreadable images are skipped. Returns the index dict.
+    """
+    if not os.path.exists(data_dir):
+        raise FileNotFoundError(f"Data directory not found: {data_dir}")
+    paths, labels, class_indices = list_image_files(data_dir)
+    class_names = sorted(class_indices, key=class_indices.get)
+    files = list(zip(paths, labels))
+    os.makedirs(output_dir, exist_ok=True)
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) * 2)
+
+    start = time.perf_counter()
+    shards = []
+    paths = []
+    labels = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for shard_start in range(0, len(files), shard_size):
+            chunk = files[shard_start:shard_start + shard_size]
+            pixels = np.empty((len(chunk), IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.uint8)
+            ok = list(pool.map(lambda i: _decode(chunk[i][0], pixels[i]), range(len(chunk))))
+            keep = [i for i, decoded in enumerate(ok) if decoded]
+            if not keep:
+                continue
+            if len(keep) != len(chunk):
+                pixels = pixels[keep]
+            shard_name = SHARD_PATTERN.format(len(shards))
+            np.save(os.path.join(output_dir, shard_name), pixels)
+            shards.append({"file": shard_name, "count": len(keep)})
+            paths.extend(os.path.relpath(chunk[i][0], data_dir).replace(os.sep, '/') for i in keep)
+            labels.extend(chunk[i][1] for i in keep)
+            logger.info("Packed %d/%d images", shard_start + len(chunk), len(files))
+
+    np.save(os.path.join(output_dir, LABELS_FILENAME), np.asarray(labels, dtype=np.int32))
+    index = {
+        "version": PACKED_FORMAT_VERSION,
+        "source_dir": os.path.abspath(data_dir),
+        "image_shape": [IMG_HEIGHT, IMG_WIDTH, 3],
+        "class_indices": {name: index for index, name in enumerate(class_names)},
+        "num_images": len(labels),
+        "skipped": len(files) - len(labels),
+        "shards": shards,
+        "paths": paths,
+        "created_at": time.time(),
+    }
+    # The index is written last, so a directory only counts as packed once every shard exists
+    tmp_path = os.path.join(output_dir, INDEX_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(output_dir, INDEX_FILENAME))
+    logger.info("Packed %d images (%d skipped) into %s in %.1fs", len(labels), index['skipped'], output_dir,
+                time.perf_counter() - start)
+    return index
+
+
+class PackedDataset:
+    """
+    Read-only view of a packed dataset. Shards are opened with np.load(mmap_mode='r'), so
+    images are paged in from disk on access and no decode or resize happens at read time.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, INDEX_FILENAME)) as f:
+            self.index = json.load(f)
+        if self.index.get("version") != PACKED_FORMAT_VERSION:
+            raise ValueError(f"Unsupported packed dataset version in {path}: {self.index.get('version')}")
+        self.path = path
+        self.class_indices = self.index["class_indices"]
+        self.paths = self.index["paths"]
+        self.labels = np.load(os.path.join(path, LABELS_FILENAME))
+        self.shards = [np.load(os.path.join(path, shard["file"]), mmap_mode='r') for shard in self.index["shards"]]
+        counts = np.array([len(shard) for shard in self.shards], dtype=np.int64)
+        self._shard_starts = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def images(self, indices):
+        """Returns a uint8 (len(indices), H, W, 3) array; only the requested rows are read."""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices),) + tuple(self.index["image_shape"]), dtype=np.uint8)
+        shard_ids = np.searchsorted(self._shard_starts, indices, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self.shards[shard_id][indices[mask] - self._shard_starts[shard_id]]
+        return out
+
+    def contiguous(self, start, stop):
+        """
+        Returns images [start, stop) as a zero-copy memmap view when they lie in one shard,
+        otherwise as a copy.
+        """
+        shard_id = int(np.searchsorted(self._shard_starts, start, side='right') - 1)
+        offset = start - self._shard_starts[shard_id]
+        if stop - self._shard_starts[shard_id] <= len(self.shards[shard_id]):
+            return self.shards[shard_id][offset:offset + (stop - start)]
+        return self.images(np.arange(start, stop))
+
+
+class PackedSequence(tf.keras.utils.Sequence):
+    """
+    Keras input for a packed dataset, usable wherever create_data_generator's iterator is:
+    yields (float32 images in [0, 1], sparse labels) batches and exposes `samples`,
+    `num_classes` and `class_indices`. Training batches get the same augmentation as the
+    tf.data pipeline, applied to the whole batch at once.
+    """
+
+    def __init__(self, dataset, batch_size=32, shuffle=True, is_training=True, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.is_training = is_training
+        self.class_indices = dataset.class_indices
+        self.samples = len(dataset)
+        self.num_classes = len(dataset.class_indices)
+        self._rng = np.random.default_rng(seed)
+        self._order = np.arange(self.samples)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(self.samples / self.batch_size)
+
+    def __getitem__(self, index):
+        batch_indices = self._order[index * self.batch_size:(index + 1) * self.batch_size]
+        if self.shuffle:
+            # Sorted reads keep memmap access sequential within each shard
+            batch_indices = np.sort(batch_indices)
+            images = self.dataset.images(batch_indices)
+        else:
+            images = self.dataset.contiguous(int(batch_indices[0]), int(batch_indices[-1]) + 1)
+        images = images.astype(np.float32)
+        if self.is_training:
+            from src.data_pipeline import augment_batch
+            images = augment_batch(tf.constant(images)).numpy()
+        images /= 255.0
+        return images, self.dataset.labels[batch_indices]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self._rng.shuffle(self._order)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack an image dataset into memory-mappable uint8 .npy shards.")
+    parser.add_argument('data_dir', help="Directory with one subdirectory per class, e.g. data/train")
+    parser.add_argument('output_dir', help="Where to write the shards, labels.npy and index.json")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    pack_dataset(args.data_dir, args.output_dir, shard_size=args.shard_size, max_workers=args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,257 @@
 import tensorflow as tf
 from tensorflow.keras.models import load_model
 import numpy as np
+import logging
 import os
+import threading
+import time
 
-MODEL_PATH = '../models/image_classifier_model.h5' # Corrected path
+from src.metrics import INFERENCE_BATCH_SIZE, MODEL_INFO, MODEL_SWAPS, PREDICT_STAGE_DURATION
+from src.model import load_model_manifest
+from src.registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODELS_DIR = os.path.join(PROJECT_ROOT, 'models')
+# Legacy single-file models, served only while the registry has no CURRENT version
+MODEL_PATH = os.path.join(MODELS_DIR, 'image_classifier_model.h5')
+# Like MODEL_PATH, only used until the registry has a CURRENT version; registry versions are served from their
+# own model.tflite (written by retraining with RETRAIN_EXPORT_TFLITE, or by `python -m src.export --publish`)
+TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', os.path.join(MODELS_DIR, 'image_classifier_model.tflite'))
+# 'keras' serves the Keras model through model.predict, 'tflite' serves the TFLite export through the TFLite interpreter
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras').lower()
+TFLITE_NUM_THREADS = int(os.environ.get('TFLITE_NUM_THREADS', 0)) or None
+TRAIN_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'train')
 # This will be dynamically set when the model is loaded or retrained
 CLASS_NAMES = ['cats', 'dogs']
 
-_model = None # Global variable to store the loaded model
-_class_names = None # Global variable to store class names
+model_registry = ModelRegistry(MODELS_DIR)
+
+_serving = None # The ServingModel every prediction uses; only ever replaced as a whole
+_model_lock = threading.Lock() # Ensures concurrent first requests load the model only once
+
+class ServingModel:
+    """
+    A loaded, warmed-up model together with everything needed to interpret its output.
+    Never modified after construction: switching models replaces the whole object with a
+    single reference assignment, so a request always sees one consistent model.
+    """
+    __slots__ = ('model', 'class_names', 'input_shape', 'version', 'model_path', 'stats')
+
+    def __init__(self, model, class_names, input_shape, version, model_path, stats):
+        self.model = model
+        self.class_names = class_names
+        self.input_shape = input_shape
+        self.version = version
+        self.model_path = model_path
+        self.stats = stats
+
+class TFLiteModel:
+    """
+    Serves an exported TFLite flatbuffer through tf.lite.Interpreter.
+    Implements the part of the Keras Model API that serving uses (`predict` and
+    `input_shape`), so it can stand in for a Keras model anywhere in this module.
+    """
+
+    def __init__(self, model_path, num_threads=TFLITE_NUM_THREADS):
+        self.model_path = model_path
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        self._lock = threading.Lock() # The interpreter is not thread-safe
+
+    @property
+    def input_shape(self):
+        return (None,) + tuple(int(dim) for dim in self._input['shape'][1:])
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            self._interpreter.resize_tensor_input(self._input['index'], [batch_size] + list(self.input_shape[1:]))
+            self._interpreter.allocate_tensors()
+            self._input = self._interpreter.get_input_details()[0]
+            self._output = self._interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def _quantize_input(self, x):
+        if self._input['dtype'] == np.float32:
+            return x.astype(np.float32, copy=False)
+        scale, zero_point = self._input['quantization']
+        info = np.iinfo(self._input['dtype'])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(self._input['dtype'])
+
+    def _dequantize_output(self, y):
+        if self._output['dtype'] == np.float32:
+            return y
+        scale, zero_point = self._output['quantization']
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict(self, x, batch_size=None, verbose=0):
+        with self._lock:
+            self._resize(len(x))
+            self._interpreter.set_tensor(self._input['index'], self._quantize_input(x))
+            self._interpreter.invoke()
+            return self._dequantize_output(self._interpreter.get_tensor(self._output['index']))
+
+def get_serving_model_path():
+    """
+    Returns (model_path, version) of the model to serve for the configured INFERENCE_BACKEND:
+    the registry's CURRENT version if there is one, otherwise the legacy model file.
+    """
+    model_path, version = model_registry.resolve_model_path(INFERENCE_BACKEND)
+    if model_path is not None:
+        return model_path, version
+    return (TFLITE_MODEL_PATH if INFERENCE_BACKEND == 'tflite' else MODEL_PATH), None
+
+def load_backend_model(model_path):
+    """Loads a saved model with the backend matching its file type (.tflite or Keras)."""
+    if model_path.endswith('.tflite'):
+        return TFLiteModel(model_path)
+    return load_model(model_path)
+
+def _resolve_class_names(model_path):
+    """
+    Returns (class_names, input_shape, source) for a saved model.
+    Prefers the sidecar manifest written by train_model; otherwise falls back to the
+    class subdirectory names of the training data (sorted, like flow_from_directory),
+    and finally to the default CLASS_NAMES.
+    """
+    manifest = load_model_manifest(model_path)
+    if manifest and manifest.get("class_indices"):
+        class_indices = manifest["class_indices"]
+        input_shape = tuple(manifest["input_shape"]) if manifest.get("input_shape") else None
+        return sorted(class_indices, key=class_indices.get), input_shape, "manifest"
+
+    if os.path.isdir(TRAIN_DATA_DIR):
+        class_names = sorted(d for d in os.listdir(TRAIN_DATA_DIR) if os.path.isdir(os.path.join(TRAIN_DATA_DIR, d)))
+        if class_names:
+            logger.warning("No manifest for %s; using class directories of %s: %s", model_path, TRAIN_DATA_DIR, class_names)
+            return class_names, None, "data_dir"
+
+    logger.warning("No manifest for %s and no training data; using default CLASS_NAMES.", model_path)
+    return CLASS_NAMES, None, "default"
+
+def load_serving_model(model_path, version=None, warm_up=True):
+    """
+    Loads a model into a new ServingModel without affecting the one currently serving.
+    With `warm_up`, also runs one dummy forward pass so its first real request is fast.
+    """
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model not found at {model_path}. Please train the model first.")
+    load_start = time.perf_counter()
+    model = load_backend_model(model_path)
+    class_names, input_shape, source = _resolve_class_names(model_path)
+    input_shape = input_shape or tuple(model.input_shape[1:])
+    loaded = time.perf_counter()
+    stats = {
+        "model_path": model_path,
+        "backend": 'tflite' if isinstance(model, TFLiteModel) else 'keras',
+        "load_seconds": loaded - load_start,
+        "class_names_source": source,
+        "cold_start_seconds": loaded - load_start,
+    }
+    if warm_up:
+        model.predict(np.zeros((1,) + tuple(input_shape), dtype=np.float32), verbose=0)
+        stats["warmup_seconds"] = time.perf_counter() - loaded
+        stats["cold_start_seconds"] = time.perf_counter() - load_start
+
+    if version is None:
+        file_stat = os.stat(model_path)
+        version = f"{os.path.basename(model_path)}:{file_stat.st_mtime_ns}:{file_stat.st_size}"
+    logger.info("Model %s loaded successfully from %s in %.2fs", version, model_path, stats['cold_start_seconds'])
+    return ServingModel(model, class_names, input_shape, version, model_path, stats)
 
-def load_ml_model(model_path=MODEL_PATH):
+def get_serving_model(model_path=None, warm_up=False):
+    """
+    Returns the ServingModel used for predictions, loading it on first use.
+    Defaults to the model given by get_serving_model_path().
+    """
+    global _serving
+    serving = _serving
+    if serving is None:
+        with _model_lock:
+            if _serving is None:
+                version = None
+                if model_path is None:
+                    model_path, version = get_serving_model_path()
+                _serving = load_serving_model(model_path, version, warm_up=warm_up)
+                _record_serving_model(_serving)
+            serving = _serving
+    return serving
+
+def _record_serving_model(serving):
+    MODEL_INFO.clear()
+    if serving is not None:
+        MODEL_INFO.labels(version=serving.version, backend=serving.stats.get("backend")).set(1)
+
+def swap_serving_model(serving):
+    """Makes `serving` the model for all subsequent predictions in one step and returns the previous one."""
+    global _serving
+    with _model_lock:
+        previous, _serving = _serving, serving
+        _record_serving_model(serving)
+    MODEL_SWAPS.inc()
+    return previous
+
+def load_model_version(version, warm_up=True):
+    """Loads a registry version for the configured INFERENCE_BACKEND (its Keras model if it has no TFLite export)."""
+    model_path = model_registry.model_path(version, INFERENCE_BACKEND)
+    if not os.path.exists(model_path):
+        model_path = model_registry.model_path(version)
+    return load_serving_model(model_path, version, warm_up=warm_up)
+
+def activate_model_version(version, set_current=True, serving=None):
+    """
+    Loads and warms up a registry version while the current model keeps serving, then swaps it in.
+    Also records it as the registry's CURRENT version unless `set_current` is False.
+    `serving` may be an already loaded ServingModel of the version (e.g. one that was just evaluated).
+    """
+    if serving is None:
+        serving = load_model_version(version)
+    if set_current:
+        model_registry.set_current(version)
+    previous = swap_serving_model(serving)
+    logger.info("Serving model switched from %s to %s", previous.version if previous else None, version)
+    return serving
+
+def load_ml_model(model_path=None):
     """
     Loads the pre-trained machine learning model.
     Uses a singleton pattern to load the model only once.
+    Returns (model, class_names) of the serving model.
     """
-    global _model, _class_names
-    if _model is None:
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model not found at {model_path}. Please train the model first.")
-        _model = load_model(model_path)
-        print(f"Model loaded successfully from {model_path}")
-
-        # Attempt to infer class names from the training data if available
-        # In a real application, class names would be saved alongside the model
-        # or passed explicitly. For this example, we'll assume a default or try to infer.
-        try:
-            # This is a simplified way to get class names.
-            # In a robust system, you'd save class_indices from ImageDataGenerator.
-            from src.preprocessing import create_data_generator
-            temp_data_dir = '../data/train' # Assuming original training data is here
-            print(f"DEBUG (prediction.py): Checking temp_data_dir: {temp_data_dir}") # Added debug print
-            if os.path.exists(temp_data_dir):
-                # Added debug print for flow_from_directory
-                print(f"DEBUG (prediction.py): Attempting to create data generator from {temp_data_dir}")
-                generator, class_indices = create_data_generator(temp_data_dir, shuffle=False, is_training=False)
-                _class_names = sorted(class_indices, key=class_indices.get)
-                print(f"DEBUG (prediction.py): Inferred class names: {_class_names}") # Added debug print
-                print(f"DEBUG (prediction.py): Class indices from generator: {class_indices}") # Added debug print
-                if not _class_names: # Added check for empty class names
-                    print("WARNING (prediction.py): Inferred class names list is empty. This might cause 'list index out of range' errors.")
-            else:
-                print(f"DEBUG (prediction.py): temp_data_dir does not exist: {temp_data_dir}. Falling back to default CLASS_NAMES.") # Added debug print
-                _class_names = CLASS_NAMES # Fallback to default
-        except Exception as e:
-            print(f"ERROR (prediction.py): Could not infer class names from data directory: {e}. Using default.") # Added debug print
-            _class_names = CLASS_NAMES
-    return _model, _class_names
+    serving = get_serving_model(model_path)
+    return serving.model, serving.class_names
 
-def predict_image(preprocessed_image_array):
+def warm_up_model(model_path=None):
     """
-    Makes a prediction on a preprocessed image array.
+    Loads the model (if needed) and runs one dummy forward pass so the first real
+    request does not pay for graph tracing. Returns the model load/warm-up stats.
     """
-    model, class_names = load_ml_model()
-    print(f"DEBUG (predict_image): Using class_names: {class_names}") # Added debug print
-    predictions = model.predict(preprocessed_image_array)
+    if _serving is None:
+        get_serving_model(model_path, warm_up=True)
+    else:
+        serving = _serving
+        serving.model.predict(np.zeros((1,) + tuple(serving.input_shape), dtype=np.float32), verbose=0)
+    return get_model_stats()
+
+def get_model_version():
+    """Returns the version identifier of the serving model, loading it if necessary."""
+    return get_serving_model().version
 
+def get_model_stats():
+    """Returns version, load, warm-up and cold-start timings for the currently loaded model."""
+    serving = _serving
+    if serving is None:
+        return {"loaded": False}
+    return dict(serving.stats, version=serving.version, loaded=True)
+
+def _format_prediction(predictions, class_names):
+    """
+    Turns the model output for a single image (shape (1, num_outputs)) into the API response dict.
+    """
     if len(class_names) > 2: # Multi-class classification
         predicted_class_index = np.argmax(predictions, axis=1)[0]
         confidence = np.max(predictions)
@@ -65,7 +261,7 @@ def predict_image(preprocessed_image_array):
 
     # Added check before accessing class_names
     if not class_names or predicted_class_index >= len(class_names) or predicted_class_index < 0:
-        print(f"ERROR (predict_image): Invalid predicted_class_index ({predicted_class_index}) or empty class_names ({class_names}).")
+        logger.error("Invalid predicted_class_index (%s) or empty class_names (%s).", predicted_class_index, class_names)
         # Fallback or raise a more specific error
         predicted_class_name = "unknown"
     else:
@@ -77,7 +273,29 @@ def predict_image(preprocessed_image_array):
         "raw_predictions": predictions.tolist()
     }
 
+def predict_batch(preprocessed_image_batch):
+    """
+    Makes predictions for a batch of preprocessed images with a single forward pass.
+    Returns one result dict per image, in input order.
+    """
+    serving = get_serving_model() # Read once so the whole batch uses one model and its class names
+    INFERENCE_BATCH_SIZE.observe(len(preprocessed_image_batch))
+    with PREDICT_STAGE_DURATION.labels(stage='forward').time():
+        predictions = serving.model.predict(preprocessed_image_batch, batch_size=len(preprocessed_image_batch), verbose=0)
+    return [_format_prediction(predictions[i:i + 1], serving.class_names) for i in range(len(predictions))]
+
+def predict_image(preprocessed_image_array):
+    """
+    Makes a prediction on a preprocessed image array.
+    """
+    model, class_names = load_ml_model()
+    logger.debug("predict_image using class_names: %s", class_names)
+    predictions = model.predict(preprocessed_image_array)
+    return _format_prediction(predictions, class_names)
+
 def reset_model_cache():
-    global _model, _class_names
-    _model = None
-    _class_names = None
+    """
+    Drops the serving model so the next request loads it again.
+    Prefer activate_model_version, which never leaves requests without a loaded model.
+    """
+    swap_serving_model(None)
@@ -1,12 +1,19 @@
-import tensorflow as tf
 from tensorflow.keras.preprocessing import image
 import numpy as np
+import io
+import logging
 import os
+import threading
 import zipfile
+from PIL import Image
 
 IMG_HEIGHT = 128
 IMG_WIDTH = 128
 
+logger = logging.getLogger(__name__)
+
+_decode_buffers = threading.local() # Per-thread preallocated (1, H, W, 3) float32 buffers
+
 def preprocess_single_image(image_path):
     """
     Loads and preprocesses a single image for prediction.
@@ -17,6 +24,60 @@ def preprocess_single_image(image_path):
     img_array /= 255.0 # Normalize to [0, 1]
     return img_array
 
+def _get_decode_buffer():
+    buffer = getattr(_decode_buffers, 'array', None)
+    if buffer is None:
+        buffer = np.empty((1, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+        _decode_buffers.array = buffer
+    return buffer
+
+def decode_image_into(source, out, use_draft=False):
+    """
+    Decodes an image (a path or file object) to RGB, resized to IMG_HEIGHT x IMG_WIDTH with
+    nearest-neighbour sampling exactly like `image.load_img`, and writes the 0-255 pixel values
+    into `out`, an array of shape (H, W, 3) of any numeric dtype.
+    """
+    with Image.open(source) as img:
+        if use_draft and img.format == 'JPEG':
+            img.draft('RGB', (IMG_WIDTH, IMG_HEIGHT))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != (IMG_WIDTH, IMG_HEIGHT):
+            img = img.resize((IMG_WIDTH, IMG_HEIGHT), Image.NEAREST)
+        out[...] = np.asarray(img, dtype=np.uint8)
+    return out
+
+def decode_image_bytes(image_bytes, out=None, use_draft=False):
+    """
+    Decodes an uploaded image in memory into `out` (or the per-thread buffer, see
+    preprocess_image_bytes) as 0-255 float32 pixel values, without normalizing them.
+    """
+    if out is None:
+        out = _get_decode_buffer()
+    decode_image_into(io.BytesIO(image_bytes), out[0] if out.ndim == 4 else out, use_draft=use_draft)
+    return out
+
+def normalize_image(image_array):
+    """Scales 0-255 pixel values to [0, 1] in place and returns the array."""
+    np.divide(image_array, 255.0, out=image_array)
+    return image_array
+
+def preprocess_image_bytes(image_bytes, out=None, use_draft=False):
+    """
+    Decodes and preprocesses an uploaded image entirely in memory.
+
+    Produces the same tensor as `preprocess_single_image` (RGB, nearest-neighbour
+    resize to IMG_HEIGHT x IMG_WIDTH, float32 scaled to [0, 1]) without touching disk.
+    The result is written into `out` (any float32 array of shape (1, H, W, 3) or (H, W, 3)),
+    or into a preallocated per-thread buffer that is reused by the next call on the same thread,
+    so callers that keep the array around must copy it.
+
+    With `use_draft=True`, JPEGs are downscaled by the decoder itself (Pillow draft mode)
+    before resizing. This is much cheaper for large photos but the pixels differ slightly
+    from the full-resolution path.
+    """
+    return normalize_image(decode_image_bytes(image_bytes, out=out, use_draft=use_draft))
+
 def load_and_preprocess_bulk_data(zip_file_path, extract_to_dir='temp_retrain_data'):
     """
     Extracts a zip file containing new training data and prepares it for retraining.
@@ -30,11 +91,11 @@ def load_and_preprocess_bulk_data(zip_file_path, extract_to_dir='temp_retrain_da
 
     with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
         zip_ref.extractall(extract_to_dir)
-    print(f"Extracted data to: {extract_to_dir}")
+    logger.info("Extracted data to: %s", extract_to_dir)
 
     # Verify structure (optional, but good for debugging)
     extracted_content = os.listdir(extract_to_dir)
-    print(f"Content of extracted directory: {extracted_content}")
+    logger.debug("Content of extracted directory: %s", extracted_content)
     if len(extracted_content) == 1 and os.path.isdir(os.path.join(extract_to_dir, extracted_content[0])):
         # If zip contains a single root folder, use that as the data directory
         return os.path.join(extract_to_dir, extracted_content[0])
@@ -43,10 +104,17 @@ def load_and_preprocess_bulk_data(zip_file_path, extract_to_dir='temp_retrain_da
 def create_data_generator(data_dir, batch_size=32, shuffle=True, is_training=True):
     """
     Creates an ImageDataGenerator for training or evaluation.
+    If `data_dir` is a packed dataset (see src/packed_dataset.py), returns a PackedSequence
+    reading the pre-decoded images from memory-mapped shards instead.
     """
     if not os.path.exists(data_dir):
         raise FileNotFoundError(f"Data directory not found: {data_dir}")
 
+    from src.packed_dataset import is_packed_dataset, PackedDataset, PackedSequence
+    if is_packed_dataset(data_dir):
+        sequence = PackedSequence(PackedDataset(data_dir), batch_size=batch_size, shuffle=shuffle, is_training=is_training)
+        return sequence, sequence.class_indices
+
     if is_training:
         datagen = image.ImageDataGenerator(
             rescale=1./255,
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import shutil
+import stat
+import time
+import uuid
+
+VERSIONS_DIRNAME = 'versions'
+CURRENT_FILENAME = 'CURRENT'
+METADATA_FILENAME = 'metadata.json'
+MODEL_FILENAME = 'model.h5'
+TFLITE_FILENAME = 'model.tflite'
+
+logger = logging.getLogger(__name__)
+
+
+def _manifest_path(model_path):
+    return os.path.splitext(model_path)[0] + '.manifest.json'
+
+
+class ModelRegistry:
+    """
+    Versioned store of trained models under `root`.
+
+    Every published model lives in its own immutable directory, versions/<version>/, holding
+    model.h5, its class-name manifest and metadata.json (plus model.tflite if exported).
+    Versions are assembled in a hidden staging directory and renamed into place in one step,
+    so a reader never sees a partially written version. The serving version is recorded in
+    the CURRENT file, which is likewise replaced atomically.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.versions_dir = os.path.join(root, VERSIONS_DIRNAME)
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def model_path(self, version, backend='keras'):
+        """Returns the model file of a version for the given backend ('keras' or 'tflite')."""
+        filename = TFLITE_FILENAME if backend == 'tflite' else MODEL_FILENAME
+        return os.path.join(self.version_dir(version), filename)
+
+    def list_versions(self):
+        """Returns all published versions, oldest first."""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(name for name in os.listdir(self.versions_dir)
+                      if not name.startswith('.') and os.path.isdir(self.version_dir(name)))
+
+    def get_metadata(self, version):
+        try:
+            with open(os.path.join(self.version_dir(version), METADATA_FILENAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def current_version(self):
+        """Returns the version recorded in CURRENT, or None if nothing has been promoted yet."""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILENAME)) as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if version and os.path.isdir(self.version_dir(version)) else None
+
+    def set_current(self, version):
+        """Atomically points CURRENT at an already published version."""
+        if not os.path.isdir(self.version_dir(version)):
+            raise ValueError(f"Unknown model version: {version}")
+        tmp_path = os.path.join(self.root, f".{CURRENT_FILENAME}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILENAME))
+
+    def publish(self, model_path, metadata=None, move=True, extra_files=None):
+        """
+        Publishes a trained model (and its sidecar manifest, if any) as a new immutable version.
+        The source files are moved into the registry unless `move` is False.
+        `extra_files` maps registry filenames (e.g. 'model.tflite') to additional files to include.
+        Returns the new version id. Does not change CURRENT.
+        """
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model not found at {model_path}")
+        created_at = time.time()
+        version = time.strftime('v%Y%m%d-%H%M%S', time.gmtime(created_at)) + '-' + uuid.uuid4().hex[:6]
+        os.makedirs(self.versions_dir, exist_ok=True)
+        staging_dir = os.path.join(self.versions_dir, f'.staging-{version}')
+        os.makedirs(staging_dir)
+
+        transfer = shutil.move if move else shutil.copy2
+        try:
+            files = {MODEL_FILENAME: model_path}
+            if os.path.exists(_manifest_path(model_path)):
+                files[os.path.splitext(MODEL_FILENAME)[0] + '.manifest.json'] = _manifest_path(model_path)
+            files.update(extra_files or {})
+            for filename, source in files.items():
+                transfer(source, os.path.join(staging_dir, filename))
+
+            with open(os.path.join(staging_dir, METADATA_FILENAME), 'w') as f:
+                json.dump(dict(metadata or {}, version=version, created_at=created_at), f, indent=2)
+
+            for filename in os.listdir(staging_dir):
+                path = os.path.join(staging_dir, filename)
+                os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            os.rename(staging_dir, self.version_dir(version))
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        return version
+
+    def resolve_model_path(self, backend='keras'):
+        """
+        Returns (model_path, version) of the CURRENT version for the given backend,
+        falling back to its Keras model if it has no TFLite export. Returns (None, None)
+        when nothing has been promoted.
+        """
+        version = self.current_version()
+        if version is None:
+            return None, None
+        path = self.model_path(version, backend)
+        if backend == 'tflite' and not os.path.exists(path):
+            logger.warning("Version %s has no TFLite export; serving its Keras model. Publish versions with "
+                           "RETRAIN_EXPORT_TFLITE=1 or `python -m src.export --publish` to serve them with TFLite.", version)
+            path = self.model_path(version)
+        return path, version
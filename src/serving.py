@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Set by gunicorn.conf.py in the master and inherited by every worker
+STATE_DIR_ENV = 'SERVE_STATE_DIR'
+WORKERS_ENV = 'SERVE_WORKERS'
+INTRA_OP_THREADS_ENV = 'SERVE_INTRA_OP_THREADS'
+INTER_OP_THREADS_ENV = 'SERVE_INTER_OP_THREADS'
+# Requests one worker can hold at once: its request threads, plus the bridge backlog under src.asgi.
+# Set by gunicorn.conf.py (gthread workers) or src/asgi.py; src.api derives its admission limits from it
+REQUEST_CAPACITY_ENV = 'SERVE_REQUEST_CAPACITY'
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_count(cpu_count=None):
+    """Half the cores: each worker gets two intra-op threads, which keeps batched forward passes efficient."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // 2)
+
+def worker_thread_env(num_workers, cpu_count=None):
+    """
+    Returns the environment that caps one worker's TensorFlow/BLAS thread pools at its share
+    of the cores, so `num_workers` workers together do not oversubscribe the machine.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    intra_op_threads = max(1, cpu_count // max(1, num_workers))
+    env = {
+        INTRA_OP_THREADS_ENV: str(intra_op_threads),
+        INTER_OP_THREADS_ENV: '1',
+        'TF_NUM_INTRAOP_THREADS': str(intra_op_threads),
+        'TF_NUM_INTEROP_THREADS': '1',
+        'OMP_NUM_THREADS': str(intra_op_threads),
+        'MKL_NUM_THREADS': str(intra_op_threads),
+        'OPENBLAS_NUM_THREADS': str(intra_op_threads),
+    }
+    if not os.environ.get('TFLITE_NUM_THREADS'):
+        env['TFLITE_NUM_THREADS'] = str(intra_op_threads)
+    return env
+
+def apply_thread_limits():
+    """
+    Applies SERVE_INTRA_OP_THREADS/SERVE_INTER_OP_THREADS to TensorFlow. Must run before the
+    first TensorFlow op; does nothing outside a multi-worker deployment.
+    """
+    intra_op_threads = int(os.environ.get(INTRA_OP_THREADS_ENV, 0))
+    inter_op_threads = int(os.environ.get(INTER_OP_THREADS_ENV, 0))
+    if not intra_op_threads and not inter_op_threads:
+        return
+    import tensorflow as tf
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e: # The runtime was already initialized
+        logger.warning("Could not apply TensorFlow thread limits: %s", e)
+
+def process_memory(pid=None):
+    """
+    Returns {"rss_bytes", "pss_bytes"} of a process. PSS splits shared pages (such as a
+    memory-mapped model file) between the processes mapping them, so summing it over workers
+    gives their real combined footprint. Values are None where /proc is unavailable.
+    """
+    pid = pid or os.getpid()
+    memory = {"rss_bytes": None, "pss_bytes": None}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    memory[f"{key.lower()}_bytes"] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
+
+def _state_dir():
+    return os.environ.get(STATE_DIR_ENV)
+
+def _state_path(pid):
+    return os.path.join(_state_dir(), f'worker-{pid}.json')
+
+def _metrics_path(pid):
+    return os.path.join(_state_dir(), f'metrics-{pid}.json')
+
+def is_multi_worker():
+    return bool(_state_dir())
+
+def mark_worker_ready(model_stats):
+    """Records that this worker has loaded and warmed up its model."""
+    if not is_multi_worker():
+        return
+    state = {"pid": os.getpid(), "ready": True, "ready_at": time.time(),
+             "model_version": model_stats.get("version"), "cold_start_seconds": model_stats.get("cold_start_seconds")}
+    path = _state_path(os.getpid())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def remove_worker_state(pid):
+    """Forgets a worker that exited (called from the gunicorn master)."""
+    if is_multi_worker():
+        for path in (_state_path(pid), _metrics_path(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def write_metrics_snapshot(samples):
+    """Publishes this worker's metric samples ({metric name: sample lines}) to the other workers."""
+    path = _metrics_path(os.getpid())
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(samples, f)
+    os.replace(tmp_path, path)
+
+def read_metrics_snapshots():
+    """Returns the latest metric samples published by every other live worker."""
+    snapshots = []
+    for name in os.listdir(_state_dir()):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        pid = int(name[len('metrics-'):-len('.json')])
+        if pid == os.getpid() or not _is_alive(pid):
+            continue
+        try:
+            with open(os.path.join(_state_dir(), name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+def start_metrics_snapshots(collect, interval_seconds):
+    """Starts a daemon thread that publishes `collect()` with write_metrics_snapshot every `interval_seconds`."""
+    def publish():
+        while True:
+            try:
+                write_metrics_snapshot(collect())
+            except Exception as e:
+                logger.warning("Could not publish metrics: %s", e)
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=publish, name='metrics-snapshots', daemon=True)
+    thread.start()
+    return thread
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+def readiness(local_model_stats):
+    """
+    Returns (ready, report). With several workers, ready means every expected worker is
+    alive and has warmed up its model; otherwise it means this process has.
+    """
+    if not is_multi_worker():
+        ready = bool(local_model_stats.get("loaded"))
+        return ready, {"ready": ready, "workers_expected": 1, "workers_ready": int(ready),
+                       "workers": [dict(pid=os.getpid(), ready=ready, model_version=local_model_stats.get("version"),
+                                        **process_memory())]}
+
+    expected = int(os.environ.get(WORKERS_ENV, 1))
+    workers = []
+    for name in os.listdir(_state_dir()):
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(_state_dir(), name)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if _is_alive(state["pid"]):
+            workers.append(dict(state, **process_memory(state["pid"])))
+    workers.sort(key=lambda state: state["pid"])
+    ready_count = sum(1 for state in workers if state.get("ready"))
+    ready = ready_count >= expected
+    return ready, {"ready": ready, "workers_expected": expected, "workers_ready": ready_count, "workers": workers}
+
+def start_model_sync(current_version, serving_version, activate, interval_seconds):
+    """
+    Starts a daemon thread that keeps this worker on the registry's CURRENT version. A model
+    activated through one worker (after a retrain or a rollback) is picked up by the others
+    within `interval_seconds`.
+    """
+    def sync():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                version = current_version()
+                if version is not None and version != serving_version():
+                    logger.info("Registry CURRENT is %s; switching this worker to it", version)
+                    activate(version)
+            except Exception as e:
+                logger.warning("Model sync failed: %s", e)
+
+    thread = threading.Thread(target=sync, name='model-sync', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,83 @@
+import bisect
+import hashlib
+import logging
+import os
+import threading
+
+from PIL import Image
+
+DEFAULT_SIZES = (64, 128, 256)
+DEFAULT_QUALITY = 85
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+    """
+    Generates JPEG thumbnails of images on demand and keeps them in `cache_dir`.
+
+    Thumbnails are keyed by the image's relative path, size and mtime, so an image that is
+    replaced gets a fresh thumbnail (and ETag) on its next request. Requested sizes are rounded
+    up to the nearest of `sizes`, which bounds the number of variants stored per image.
+    """
+
+    def __init__(self, cache_dir, sizes=DEFAULT_SIZES, quality=DEFAULT_QUALITY):
+        self.cache_dir = cache_dir
+        self.sizes = tuple(sorted(sizes))
+        self.quality = quality
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._counters = {"hits": 0, "generated": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def snap_size(self, size):
+        """Returns the smallest configured size at least `size` (the largest one if none is)."""
+        index = bisect.bisect_left(self.sizes, size)
+        return self.sizes[min(index, len(self.sizes) - 1)]
+
+    @staticmethod
+    def make_etag(relative_path, size, stat):
+        return hashlib.sha1(f"{relative_path}:{size}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, relative_path, source_path, size):
+        """
+        Returns (thumbnail_path, etag, source_stat) for `source_path`, generating the thumbnail
+        if it is not cached yet. Concurrent requests for the same thumbnail generate it once.
+        """
+        stat = os.stat(source_path)
+        etag = self.make_etag(relative_path, size, stat)
+        path = os.path.join(self.cache_dir, etag[:2], etag + '.jpg')
+        if os.path.exists(path):
+            self._counters["hits"] += 1
+            return path, etag, stat
+
+        with self._lock_for(etag):
+            if not os.path.exists(path):
+                self._generate(source_path, path, size)
+                self._counters["generated"] += 1
+            else:
+                self._counters["hits"] += 1
+        with self._locks_lock:
+            self._locks.pop(etag, None)
+        return path, etag, stat
+
+    def _generate(self, source_path, path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with Image.open(source_path) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (size, size)) # Let the decoder downscale large JPEGs cheaply
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail((size, size), Image.LANCZOS)
+            img.save(tmp_path, format='JPEG', quality=self.quality, optimize=True)
+        # Written under a temporary name first so other workers never serve a partial file
+        os.replace(tmp_path, path)
+        logger.debug("Generated %dpx thumbnail of %s", size, source_path)
+
+    def stats(self):
+        return dict(self._counters, sizes=list(self.sizes))
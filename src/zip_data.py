@@ -0,0 +1,109 @@
+import logging
+import threading
+import zipfile
+
+import numpy as np
+import tensorflow as tf
+
+from src.data_pipeline import AUTOTUNE, IMAGE_EXTENSIONS, batch_and_prefetch, decode_and_resize
+
+MAX_MEMBER_BYTES = 50 * 1024 * 1024 # Larger members are skipped rather than decompressed into memory
+
+logger = logging.getLogger(__name__)
+
+
+class ZipImageSource:
+    """
+    Indexes the image members of a training zip without extracting it.
+
+    Classes are inferred from member paths the same way an extracted upload is read:
+    <class>/<image>, optionally below a single top-level folder (data.zip -> data/<class>/...).
+    macOS metadata, hidden files, empty members and members over `max_member_bytes` are skipped.
+    `read()` may be called from many threads at once; each thread gets its own ZipFile handle
+    so members are decompressed in parallel.
+    """
+
+    def __init__(self, zip_path, max_member_bytes=MAX_MEMBER_BYTES):
+        self.zip_path = zip_path
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+        self.skipped = []
+
+        with zipfile.ZipFile(zip_path) as archive:
+            candidates = [] # (member name, path components)
+            for info in archive.infolist():
+                parts = info.filename.split('/')
+                if info.is_dir() or parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts):
+                    continue
+                if not parts[-1].lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.file_size == 0 or info.file_size > max_member_bytes:
+                    self.skipped.append(info.filename)
+                    continue
+                candidates.append((info.filename, parts))
+
+        # Strip a single top-level folder shared by every image
+        if candidates and all(len(parts) >= 3 for _, parts in candidates) and len({parts[0] for _, parts in candidates}) == 1:
+            candidates = [(name, parts[1:]) for name, parts in candidates]
+        # Images outside any class folder are ignored
+        candidates = [(name, parts) for name, parts in candidates if len(parts) >= 2]
+
+        class_names = sorted({parts[0] for _, parts in candidates})
+        self.class_indices = {name: index for index, name in enumerate(class_names)}
+        candidates.sort()
+        self.names = [name for name, _ in candidates]
+        self.labels = [self.class_indices[parts[0]] for _, parts in candidates]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _archive(self):
+        archive = getattr(self._local, 'archive', None)
+        if archive is None:
+            archive = zipfile.ZipFile(self.zip_path)
+            self._local.archive = archive
+            with self._handles_lock:
+                self._handles.append(archive)
+        return archive
+
+    def read(self, index):
+        """Returns the raw bytes of the member at `index`."""
+        return self._archive().read(self.names[index])
+
+    def close(self):
+        with self._handles_lock:
+            for archive in self._handles:
+                archive.close()
+            self._handles.clear()
+
+
+def create_zip_dataset(zip_path, batch_size=32, shuffle=True, is_training=True):
+    """
+    Builds a tf.data training pipeline that streams images straight out of a zip archive:
+    members are read and decoded in parallel, corrupt or undecodable members are dropped,
+    and batches get the same augmentation and rescaling as create_tf_dataset. Only member
+    indices are shuffled, so memory use is bounded by the prefetch buffers, not the archive size.
+    Returns (dataset, class_indices, num_samples, source); call source.close() when done.
+    """
+    source = ZipImageSource(zip_path)
+    if source.skipped:
+        logger.warning("Skipping %d empty or oversized zip members, e.g. %s", len(source.skipped), source.skipped[:3])
+    if len(source) == 0:
+        return None, source.class_indices, 0, source
+
+    def read_member(index):
+        return source.read(int(index.numpy()))
+
+    def load(index, label):
+        image_bytes = tf.py_function(read_member, [index], tf.string)
+        image_bytes.set_shape(())
+        return decode_and_resize(image_bytes), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((np.arange(len(source), dtype=np.int64),
+                                                  np.asarray(source.labels, dtype=np.int32)))
+    if shuffle:
+        dataset = dataset.shuffle(len(source), reshuffle_each_iteration=True)
+    dataset = dataset.map(load, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    dataset = dataset.ignore_errors(log_warning=True) # Corrupt members (bad CRC, undecodable data) are skipped
+    return batch_and_prefetch(dataset, batch_size, is_training), source.class_indices, len(source), source